@@ -1,11 +1,64 @@
-from flask import Flask, render_template_string, request, jsonify
-import re
-import math
-import requests
+from flask import Flask, Response, render_template_string, request, jsonify
 import os
+import time
+
+import httpx
+
+# parse_proxy_string, geocode_with_mapbox and haversine_distance are re-exported
+# so existing `from app import ...` imports keep working.
+from checker import (
+    BATCH_CONCURRENCY,
+    BATCH_MAX_PROXIES,
+    exit_index,
+    gateway_limits,
+    geocode_cache,
+    geocode_flights,
+    geocode_many_async,
+    geocode_with_mapbox,
+    geocode_with_mapbox_async,
+    haversine_distance,
+    ip_intel_backend,
+    ip_intel_cache,
+    ip_intel_flights,
+    iter_events,
+    parse_proxy_string,
+    result_cache,
+    result_store,
+    run_batch,
+    run_batch_async,
+    run_check,
+    run_check_async,
+    run_sync,
+    shape_result,
+    upstream_limiter,
+)
+from exitip import echo_stats
+from fastjson import dumps
+from hunt import hunt_exits
+from jobs import JOB_MAX_PROXIES, job_manager
+from metrics import render as render_metrics
+from ranking import nearest_exits
+from rules import RejectRules
+from tracing import configure_logging
 
 app = Flask(__name__)
 
+# Check logs carry the check's trace ID; LOG_LEVEL=DEBUG adds one line per upstream call
+configure_logging(os.environ.get('LOG_LEVEL', 'INFO'))
+
+
+@app.before_request
+def resume_jobs():
+    """Start this worker's job scheduler on its first request.
+
+    Not at import: under ``gunicorn --preload`` the app is imported by the
+    master, and a scheduler started there would not survive the fork into
+    the workers. Picks up queued jobs and jobs left behind by a worker that
+    restarted.
+    """
+    if job_manager is not None:
+        job_manager.resume()
+
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
@@ -370,6 +423,96 @@ HTML_TEMPLATE = '''
         
         .legend-dot.target { background: #00ff88; }
         .legend-dot.proxy { background: #00d9ff; }
+        
+        .progress-line {
+            color: #aaa;
+            font-size: 13px;
+            margin-top: 6px;
+        }
+        
+        .batch-summary {
+            color: #888;
+            font-size: 13px;
+            margin-bottom: 15px;
+        }
+        
+        .batch-table {
+            width: 100%;
+            border-collapse: collapse;
+            font-size: 13px;
+        }
+        
+        .batch-table th, .batch-table td {
+            text-align: left;
+            padding: 8px 6px;
+            border-bottom: 1px solid rgba(255, 255, 255, 0.05);
+        }
+        
+        .batch-table th {
+            color: #888;
+            font-weight: 500;
+        }
+        
+        .batch-table tr.clickable {
+            cursor: pointer;
+        }
+        
+        .batch-table tr.clickable:hover {
+            background: rgba(255, 255, 255, 0.05);
+        }
+        
+        .batch-table .failed {
+            color: #ff4757;
+        }
+        
+        .waterfall-row {
+            display: flex;
+            align-items: center;
+            font-size: 12px;
+            padding: 4px 0;
+        }
+        
+        .waterfall-label {
+            width: 200px;
+            flex-shrink: 0;
+            color: #888;
+            overflow: hidden;
+            text-overflow: ellipsis;
+            white-space: nowrap;
+        }
+        
+        .waterfall-track {
+            position: relative;
+            flex: 1;
+            height: 14px;
+        }
+        
+        .waterfall-bar {
+            position: absolute;
+            height: 100%;
+            display: flex;
+            min-width: 2px;
+            background: #555;
+            border-radius: 2px;
+            overflow: hidden;
+        }
+        
+        .waterfall-bar.cancelled {
+            opacity: 0.4;
+        }
+        
+        .waterfall-legend span {
+            display: inline-block;
+            width: 10px;
+            height: 10px;
+            margin: 0 4px 0 12px;
+            border-radius: 2px;
+        }
+        
+        .phase-connect { background: #ffa502; }
+        .phase-tunnel { background: #a55eea; }
+        .phase-tls { background: #1e90ff; }
+        .phase-wait { background: #2ed573; }
     </style>
 </head>
 <body>
@@ -403,18 +546,35 @@ HTML_TEMPLATE = '''
             </div>
             
             <div class="form-group">
-                <label>Proxy String</label>
+                <label>Proxy String <span class="label-hint">— one per line to check several at once</span></label>
                 <textarea id="proxyString" placeholder="package-327430-country-us-region-california-city-san+diego-sessionid-xxx-sessionlength-600:password@proxy.soax.com:5000"></textarea>
             </div>
             
             <div class="form-group">
                 <label>Target Address</label>
                 <input type="text" id="targetAddress" placeholder="1208 Wren St, San Diego, CA 92114">
+                <div class="save-key">
+                    <input type="checkbox" id="forceLive">
+                    <label for="forceLive" style="margin: 0; font-weight: normal;">Force a live check (ignore recent results)</label>
+                </div>
+                <div class="save-key">
+                    <input type="checkbox" id="showTimings">
+                    <label for="showTimings" style="margin: 0; font-weight: normal;">Show timing waterfall</label>
+                </div>
+            </div>
+            
+            <div class="form-group">
+                <label>Exit Hunting <span class="label-hint">— rotate the session ID until an exit lands this close</span></label>
+                <input type="number" id="huntMiles" value="5" min="0.1" step="0.1" style="width: 100px;"> miles,
+                up to <input type="number" id="huntBudget" value="50" min="1" max="500" style="width: 100px;"> sessions
             </div>
             
-            <button class="btn" id="checkBtn" onclick="checkProxy()">
+            <button class="btn" id="checkBtn" onclick="checkProxy(false)">
                 Check Proxy Location
             </button>
+            <button class="btn" id="huntBtn" onclick="checkProxy(true)" style="margin-top: 10px;">
+                🎯 Hunt for a Close Exit
+            </button>
         </div>
         
         <div class="results" id="results">
@@ -433,7 +593,7 @@ HTML_TEMPLATE = '''
             }
         };
         
-        async function checkProxy() {
+        async function checkProxy(hunt) {
             const mapboxKey = document.getElementById('mapboxKey').value.trim();
             const ip2locationKey = document.getElementById('ip2locationKey').value.trim();
             const proxyString = document.getElementById('proxyString').value.trim();
@@ -441,14 +601,15 @@ HTML_TEMPLATE = '''
             const saveKey = document.getElementById('saveKey').checked;
             const saveIp2Key = document.getElementById('saveIp2Key').checked;
             const resultsDiv = document.getElementById('results');
-            const btn = document.getElementById('checkBtn');
+            const btn = document.getElementById(hunt ? 'huntBtn' : 'checkBtn');
+            const btnLabel = btn.textContent;
             
             if (!mapboxKey) {
                 alert('Please enter your Mapbox API key');
                 return;
             }
             
-            if (!ip2locationKey) {
+            if (!ip2locationKey && {{ 'true' if ip2location_key_required else 'false' }}) {
                 alert('Please enter your IP2Location API key');
                 return;
             }
@@ -470,55 +631,222 @@ HTML_TEMPLATE = '''
                 localStorage.removeItem('ip2location_api_key');
             }
             
+            const proxyStrings = proxyString.split('\\n').map(p => p.trim()).filter(p => p);
+            if (hunt && proxyStrings.length > 1) {
+                alert('Exit hunting takes a single proxy string');
+                return;
+            }
+            const isBatch = hunt || proxyStrings.length > 1;
+            const request = {
+                target_address: targetAddress,
+                mapbox_key: mapboxKey,
+                ip2location_key: ip2locationKey,
+                force: document.getElementById('forceLive').checked,
+                verbose: !isBatch,
+                timings: document.getElementById('showTimings').checked
+            };
+            if (hunt) {
+                request.proxy_string = proxyString;
+                request.stream = true;
+                request.max_miles = parseFloat(document.getElementById('huntMiles').value);
+                request.budget = parseInt(document.getElementById('huntBudget').value);
+            } else if (isBatch) {
+                request.proxy_strings = proxyStrings;
+            } else {
+                request.proxy_string = proxyString;
+            }
+            
             btn.disabled = true;
-            btn.textContent = 'Checking...';
+            btn.textContent = hunt ? 'Hunting...' : 'Checking...';
             resultsDiv.className = 'results show';
             resultsDiv.innerHTML = `
                 <div class="card">
                     <div class="loading">
                         <div class="spinner"></div>
                         <p>Connecting through proxy & checking location...</p>
+                        <div id="progress"></div>
                     </div>
                 </div>
             `;
             
+            const batch = { total: hunt ? request.budget : proxyStrings.length, results: [] };
+            
             try {
-                const response = await fetch('/check', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ 
-                        proxy_string: proxyString, 
-                        target_address: targetAddress,
-                        mapbox_key: mapboxKey,
-                        ip2location_key: ip2locationKey
-                    })
+                await streamCheck(hunt ? '/hunt' : '/check-stream', request, function(event) {
+                    if (event.event === 'error') {
+                        showError(event.error);
+                    } else if (isBatch) {
+                        handleBatchEvent(event, batch, mapboxKey);
+                    } else {
+                        handleCheckEvent(event, mapboxKey);
+                    }
                 });
+            } catch (err) {
+                showError(`Connection error: ${err.message}`);
+            }
+            
+            btn.disabled = false;
+            btn.textContent = btnLabel;
+        }
+        
+        // POST to a streaming endpoint and call onEvent for every newline-delimited JSON event as it arrives
+        async function streamCheck(url, request, onEvent) {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(request)
+            });
+            
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
                 
-                const data = await response.json();
-                
-                if (data.error) {
-                    resultsDiv.innerHTML = `
-                        <div class="card">
-                            <div class="error">❌ ${data.error}</div>
-                        </div>
-                    `;
+                let newline;
+                while ((newline = buffer.indexOf('\\n')) >= 0) {
+                    const line = buffer.slice(0, newline).trim();
+                    buffer = buffer.slice(newline + 1);
+                    if (line) onEvent(JSON.parse(line));
+                }
+            }
+        }
+        
+        function showError(message) {
+            document.getElementById('results').innerHTML = `
+                <div class="card">
+                    <div class="error">❌ ${message}</div>
+                </div>
+            `;
+        }
+        
+        function addProgress(text) {
+            const progress = document.getElementById('progress');
+            if (progress) {
+                progress.insertAdjacentHTML('beforeend', `<div class="progress-line">${text}</div>`);
+            }
+        }
+        
+        function handleCheckEvent(event, mapboxKey) {
+            if (event.event === 'geocoded') {
+                addProgress(`📍 Target found: ${event.target.place_name}`);
+            } else if (event.event === 'exit_ip') {
+                addProgress(`🌐 Exit IP: ${event.ip}`);
+            } else if (event.event === 'ip_intel') {
+                addProgress(`🔍 Exit location: ${event.city}, ${event.region}, ${event.country}`);
+            } else if (event.event === 'cached') {
+                addProgress(`⚡ Using a result from ${Math.round(event.age_seconds)}s ago`);
+            } else if (event.event === 'result') {
+                if (event.result.error) {
+                    showError(event.result.error);
                 } else {
-                    displayResults(data, mapboxKey);
+                    displayResults(event.result, mapboxKey);
                 }
-            } catch (err) {
-                resultsDiv.innerHTML = `
+            }
+        }
+        
+        function handleBatchEvent(event, batch, mapboxKey) {
+            if (event.event === 'geocoded') {
+                document.getElementById('results').innerHTML = `
                     <div class="card">
-                        <div class="error">❌ Connection error: ${err.message}</div>
+                        <div class="result-section">
+                            <h3>📋 Batch Results</h3>
+                            <div class="batch-summary">
+                                Target: ${event.target.place_name}<br>
+                                <span id="batchCount">0 / ${batch.total} checked</span>
+                            </div>
+                            <table class="batch-table">
+                                <thead>
+                                    <tr><th>#</th><th>Distance</th><th>Exit IP</th><th>Location</th><th>Proxy</th></tr>
+                                </thead>
+                                <tbody id="batchRows"></tbody>
+                            </table>
+                        </div>
                     </div>
+                    <div id="batchDetail"></div>
                 `;
+            } else if (event.event === 'result') {
+                batch.results.push(event.result);
+                renderBatchRows(batch, mapboxKey);
+                document.getElementById('batchCount').textContent = `${batch.results.length} / ${batch.total} checked`;
+            } else if (event.event === 'done' && event.found !== undefined) {
+                document.getElementById('batchCount').textContent = (event.found ? '🎯 Close exit found' : 'No exit close enough')
+                    + ` after ${event.total} sessions - ${event.succeeded} OK, ${event.failed} failed. Click a row for details.`;
+            } else if (event.event === 'done') {
+                document.getElementById('batchCount').textContent =
+                    `${event.total} checked - ${event.succeeded} OK, ${event.failed} failed. Click a row for details.`;
             }
+        }
+        
+        function renderBatchRows(batch, mapboxKey) {
+            const ok = batch.results.filter(r => !r.error).sort((a, b) => a.distance_miles - b.distance_miles);
+            const failed = batch.results.filter(r => r.error);
+            const rows = ok.concat(failed);
             
-            btn.disabled = false;
-            btn.textContent = 'Check Proxy Location';
+            document.getElementById('batchRows').innerHTML = rows.map((r, i) => r.error ? `
+                <tr>
+                    <td>-</td>
+                    <td colspan="3" class="failed">${r.error}</td>
+                    <td>${r.proxy_string.split(':')[0]}</td>
+                </tr>
+            ` : `
+                <tr class="clickable" data-row="${i}">
+                    <td>${i + 1}</td>
+                    <td>${r.distance_miles.toFixed(1)} mi</td>
+                    <td>${r.ip}${r.is_proxy ? ' 🚨' : ''}${r.cached ? ' ⚡' : ''}</td>
+                    <td>${r.city}, ${r.region}</td>
+                    <td>${r.proxy_string.split(':')[0]}</td>
+                </tr>
+            `).join('');
+            
+            document.querySelectorAll('#batchRows tr.clickable').forEach(function(tr) {
+                tr.onclick = function() {
+                    displayResults(rows[tr.dataset.row], mapboxKey, document.getElementById('batchDetail'));
+                };
+            });
         }
         
-        function displayResults(data, mapboxKey) {
-            const resultsDiv = document.getElementById('results');
+        function renderWaterfall(data) {
+            const calls = data.timings;
+            const end = Math.max(1, ...calls.map(c => c.start_ms + c.total_ms));
+            const phases = [['connect_ms', 'connect'], ['tunnel_ms', 'tunnel'], ['tls_ms', 'tls'], ['first_byte_ms', 'wait']];
+            
+            const rows = calls.map(c => {
+                const segments = phases.filter(([key]) => c[key]).map(([key, cls]) =>
+                    `<div class="phase-${cls}" style="width:${c[key] / c.total_ms * 100}%"></div>`
+                ).join('');
+                const detail = phases.filter(([key]) => c[key] !== null).map(([key, cls]) => `${cls} ${c[key]} ms`).join(', ');
+                return `
+                    <div class="waterfall-row" title="${c.host}: ${detail ? detail + ', ' : ''}total ${c.total_ms} ms (${c.outcome})">
+                        <div class="waterfall-label">${c.call} · ${c.host}</div>
+                        <div class="waterfall-track">
+                            <div class="waterfall-bar ${c.outcome === 'cancelled' ? 'cancelled' : ''}"
+                                 style="left:${c.start_ms / end * 100}%; width:${c.total_ms / end * 100}%">${segments}</div>
+                        </div>
+                    </div>
+                `;
+            }).join('');
+            
+            return `
+                <div class="result-section">
+                    <h3>⏱️ Timings (trace ${data.trace_id})</h3>
+                    ${rows || '<div class="batch-summary">No upstream calls were made</div>'}
+                    <div class="batch-summary waterfall-legend">
+                        <span class="phase-connect"></span>connect
+                        <span class="phase-tunnel"></span>proxy tunnel
+                        <span class="phase-tls"></span>TLS
+                        <span class="phase-wait"></span>first byte
+                        · ${Math.round(end)} ms total
+                    </div>
+                </div>
+            `;
+        }
+        
+        function displayResults(data, mapboxKey, container) {
+            const resultsDiv = container || document.getElementById('results');
             
             let assessmentClass = 'donotuse';
             let assessmentText = '🚨❌ DO NOT USE - Too far from target ❌🚨';
@@ -545,6 +873,7 @@ HTML_TEMPLATE = '''
                         <div class="distance-km">${data.distance_km.toFixed(1)} km</div>
                         <div class="assessment ${assessmentClass}">${assessmentText}</div>
                         ${data.is_proxy ? '<div class="proxy-warning">🚨 WARNING: PROXY DETECTED - AVOID USING THIS PROXY 🚨</div>' : ''}
+                        <div class="distance-km">${data.cached ? `⚡ Cached result from ${Math.round(data.cached_age_seconds)}s ago` : '🔴 Live check'}</div>
                     </div>
                 </div>
                 
@@ -639,6 +968,9 @@ HTML_TEMPLATE = '''
                         </div>
                     </div>
                     
+                    ${data.timings ? renderWaterfall(data) : ''}
+                    
+                    ${data.debug_full_response === undefined ? '' : `
                     <div class="result-section">
                         <h3>🐛 Debug Info</h3>
                         <div class="result-row">
@@ -662,6 +994,7 @@ HTML_TEMPLATE = '''
                             <span class="result-value" style="font-size:9px; max-height:200px; overflow:auto; display:block;">${JSON.stringify(data.debug_full_response, null, 2)}</span>
                         </div>
                     </div>
+                    `}
                     
                     <div class="result-section">
                         <h3>📍 Target Address (via Mapbox)</h3>
@@ -783,223 +1116,500 @@ HTML_TEMPLATE = '''
 '''
 
 
-def parse_proxy_string(proxy_string):
-    """Parse a SOAX-style proxy string."""
-    result = {
-        "claimed_country": None,
-        "claimed_region": None,
-        "claimed_city": None,
-        "username": None,
-        "password": None,
-        "host": None,
-        "port": None,
-    }
+@app.route('/')
+def index():
+    return render_template_string(HTML_TEMPLATE, ip2location_key_required=ip_intel_backend.remote)
+
+
+@app.route('/check', methods=['POST'])
+def check():
+    data = request.json
+    proxy_string = data.get('proxy_string', '')
+    target_address = data.get('target_address', '')
+    mapbox_key = data.get('mapbox_key', '')
+    ip2location_key = data.get('ip2location_key', '')
+    force = bool(data.get('force', False))
+    timings = bool(data.get('timings', False))
+    try:
+        fields, verbose = read_shape(data)
+        rules = RejectRules.from_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
     
-    match = re.match(r'^(.+):(.+)@(.+):(\d+)$', proxy_string)
-    if not match:
-        raise ValueError("Invalid proxy string format. Expected: username:password@host:port")
+    result = run_check(proxy_string, target_address, mapbox_key, ip2location_key, force=force, timings=timings, rules=rules)
+    return json_response(shape_result(result, fields, verbose))
+
+
+def read_shape(data):
+    """Read the response shape options: ``fields`` (list or comma-separated) and ``verbose``."""
+    fields = data.get('fields')
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+    if fields is not None and not isinstance(fields, list):
+        raise ValueError("fields must be a list or a comma-separated string")
+    return fields or None, bool(data.get('verbose', False))
+
+
+def json_response(payload):
+    return Response(dumps(payload), mimetype='application/json')
+
+
+def read_proxy_strings(data, max_proxies=BATCH_MAX_PROXIES):
+    """Read and validate the proxy list of a batch request.
+
+    Accepts either a JSON list or a newline-separated block pasted from a pool export.
+    """
+    proxy_strings = data.get('proxy_strings', [])
+    if isinstance(proxy_strings, str):
+        proxy_strings = proxy_strings.splitlines()
+    proxy_strings = [p.strip() for p in proxy_strings if p and p.strip()]
     
-    result["username"] = match.group(1)
-    result["password"] = match.group(2)
-    result["host"] = match.group(3)
-    result["port"] = int(match.group(4))
+    if not proxy_strings:
+        raise ValueError("Please provide at least one proxy string")
+    if len(proxy_strings) > max_proxies:
+        raise ValueError(f"Too many proxies - at most {max_proxies} per batch")
+    return proxy_strings
+
+
+def read_concurrency(data):
+    try:
+        return int(data.get('concurrency', BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        raise ValueError("concurrency must be an integer")
+
+
+def read_stop_after(data):
+    """Read ``stop_after``: end a batch once this many proxies pass (None = check them all)."""
+    if data.get('stop_after') is None:
+        return None
+    try:
+        stop_after = int(data['stop_after'])
+    except (TypeError, ValueError):
+        raise ValueError("stop_after must be an integer")
+    if stop_after < 1:
+        raise ValueError("stop_after must be at least 1")
+    return stop_after
+
+
+@app.route('/check-batch', methods=['POST'])
+def check_batch():
+    data = request.json
+    target_address = data.get('target_address', '')
+    mapbox_key = data.get('mapbox_key', '')
+    ip2location_key = data.get('ip2location_key', '')
     
-    username = result["username"]
+    try:
+        proxy_strings = read_proxy_strings(data)
+        concurrency = read_concurrency(data)
+        fields, verbose = read_shape(data)
+        rules = RejectRules.from_request(data)
+        stop_after = read_stop_after(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
     
-    country_match = re.search(r'country-([a-z]+)', username, re.IGNORECASE)
-    if country_match:
-        result["claimed_country"] = country_match.group(1).upper()
+    force = bool(data.get('force', False))
+    timings = bool(data.get('timings', False))
+    summary = run_batch(proxy_strings, target_address, mapbox_key, ip2location_key, concurrency, force=force, timings=timings,
+                        rules=rules, stop_after=stop_after)
+    if 'results' in summary:
+        summary['results'] = [shape_result(r, fields, verbose) for r in summary['results']]
+    return json_response(summary)
+
+
+@app.route('/check-stream', methods=['POST'])
+def check_stream():
+    """Stream check progress as newline-delimited JSON, one event per line.
+
+    Send ``proxy_string`` for one proxy or ``proxy_strings`` for a batch. Events:
+    ``geocoded``, then per proxy ``exit_ip``, ``ip_intel`` (or ``cached``) and
+    ``result`` (tagged with the proxy's ``index``), then ``done``; ``error`` if
+    the whole check fails.
+    """
+    data = request.json
+    target_address = data.get('target_address', '')
+    mapbox_key = data.get('mapbox_key', '')
+    ip2location_key = data.get('ip2location_key', '')
+    force = bool(data.get('force', False))
+    timings = bool(data.get('timings', False))
+    try:
+        fields, verbose = read_shape(data)
+        rules = RejectRules.from_request(data)
+    except ValueError as e:
+        return stream_events([{"event": "error", "error": str(e)}])
     
-    region_match = re.search(r'region-([a-z\+]+)', username, re.IGNORECASE)
-    if region_match:
-        result["claimed_region"] = region_match.group(1).replace('+', ' ').title()
+    def shaped(emit):
+        def emit_shaped(event):
+            if event["event"] == "result":
+                event = dict(event, result=shape_result(event["result"], fields, verbose))
+            emit(event)
+        return emit_shaped
     
-    city_match = re.search(r'city-([a-z\+]+)', username, re.IGNORECASE)
-    if city_match:
-        result["claimed_city"] = city_match.group(1).replace('+', ' ').title()
+    if 'proxy_strings' in data:
+        try:
+            proxy_strings = read_proxy_strings(data)
+            concurrency = read_concurrency(data)
+            stop_after = read_stop_after(data)
+        except ValueError as e:
+            return stream_events([{"event": "error", "error": str(e)}])
+        
+        async def start(emit):
+            emit = shaped(emit)
+            summary = await run_batch_async(proxy_strings, target_address, mapbox_key, ip2location_key, concurrency, on_event=emit, force=force, timings=timings,
+                                            rules=rules, stop_after=stop_after)
+            if 'error' in summary:
+                emit({"event": "error", "error": summary['error']})
+    else:
+        proxy_string = data.get('proxy_string', '')
+        
+        async def start(emit):
+            emit = shaped(emit)
+            result = await run_check_async(proxy_string, target_address, mapbox_key, ip2location_key, on_event=emit, force=force, timings=timings, rules=rules)
+            emit({"event": "result", "index": 0, "result": result})
+            failed = int('error' in result)
+            emit({"event": "done", "total": 1, "succeeded": 1 - failed, "failed": failed, "rejected": int('rejected' in result), "skipped": 0})
     
-    return result
+    return stream_events(iter_events(start))
 
 
-def geocode_with_mapbox(address, api_key):
-    """Geocode an address using Mapbox Geocoding API."""
-    url = "https://api.mapbox.com/geocoding/v5/mapbox.places/{}.json".format(
-        requests.utils.quote(address)
-    )
-    params = {
-        "access_token": api_key,
-        "limit": 1
-    }
-    
-    response = requests.get(url, params=params, timeout=10)
-    data = response.json()
-    
-    if response.status_code == 401:
-        raise ValueError("Invalid Mapbox API key")
+@app.route('/hunt', methods=['POST'])
+def hunt():
+    """Rotate the session ID of ``proxy_string`` until ``k`` exits are within ``max_miles`` of the target.
+
+    Stops early once found; ``budget`` caps the sessions tried and
+    ``time_budget`` the seconds spent. With ``stream: true`` progress comes
+    as NDJSON events like /check-stream (``done`` also carries ``found``).
+    """
+    data = request.json
+    proxy_string = data.get('proxy_string', '').strip()
+    target_address = data.get('target_address', '')
+    mapbox_key = data.get('mapbox_key', '')
+    ip2location_key = data.get('ip2location_key', '')
     
-    if "features" not in data or len(data["features"]) == 0:
-        return None
+    try:
+        parse_proxy_string(proxy_string)
+        k = int(data.get('k', 1))
+        max_miles = float(data.get('max_miles', 5))
+        budget = int(data.get('budget', 50))
+        concurrency = int(data.get('concurrency', 10))
+        time_budget = float(data['time_budget']) if data.get('time_budget') is not None else None
+        fields, verbose = read_shape(data)
+        for name, value in (('k', k), ('budget', budget), ('concurrency', concurrency)):
+            if value < 1:
+                raise ValueError(f"{name} must be at least 1")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)})
     
-    feature = data["features"][0]
-    coords = feature["geometry"]["coordinates"]
+    def shape(result):
+        return shape_result(result, fields, verbose)
     
-    return {
-        "lat": coords[1],
-        "lon": coords[0],
-        "place_name": feature["place_name"],
-    }
-
-
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points in miles."""
-    R = 3959
-    lat1_rad, lat2_rad = math.radians(lat1), math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
+    options = dict(k=k, max_miles=max_miles, budget=budget, concurrency=concurrency,
+                   clean_only=bool(data.get('clean_only', True)), time_budget=time_budget)
     
-    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    if data.get('stream'):
+        async def start(emit):
+            def emit_shaped(event):
+                if event["event"] == "result":
+                    event = dict(event, result=shape(event["result"]))
+                emit(event)
+            summary = await hunt_exits(proxy_string, target_address, mapbox_key, ip2location_key, on_event=emit_shaped, **options)
+            if 'error' in summary:
+                emit({"event": "error", "error": summary['error']})
+        return stream_events(iter_events(start))
     
-    return R * c
+    summary = run_sync(hunt_exits(proxy_string, target_address, mapbox_key, ip2location_key, **options))
+    if 'error' not in summary:
+        summary['found'] = [shape(r) for r in summary['found']]
+        summary['closest'] = [shape(r) for r in summary['closest']]
+    return json_response(summary)
 
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+def stream_events(events):
+    lines = (dumps(event) + b'\n' for event in events)
+    return Response(lines, mimetype='application/x-ndjson', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
 
 
-@app.route('/check', methods=['POST'])
-def check():
+@app.route('/best-proxies', methods=['POST'])
+def best_proxies():
+    """Rank already checked exits against many target addresses.
+
+    Takes ``exits`` (results from /check or /check-batch) and ``target_addresses``
+    and returns the ``k`` closest clean exits for each target.
+    """
     data = request.json
-    proxy_string = data.get('proxy_string', '')
-    target_address = data.get('target_address', '')
+    exits = [e for e in data.get('exits', []) if 'error' not in e and 'actual_lat' in e]
+    target_addresses = [a.strip() for a in data.get('target_addresses', []) if a and a.strip()]
     mapbox_key = data.get('mapbox_key', '')
-    ip2location_key = data.get('ip2location_key', '')
     
+    if not target_addresses:
+        return jsonify({"error": "Please provide at least one target address"})
     try:
-        # Parse proxy string
-        proxy_info = parse_proxy_string(proxy_string)
-        
-        # Geocode target address with Mapbox
-        target_coords = geocode_with_mapbox(target_address, mapbox_key)
-        if not target_coords:
-            return jsonify({"error": "Could not geocode the target address. Please check the address and try again."})
-        
-        # Build proxy URL
-        proxy_url = f"http://{proxy_info['username']}:{proxy_info['password']}@{proxy_info['host']}:{proxy_info['port']}"
-        proxies = {"http": proxy_url, "https": proxy_url}
-        
-        # Step 1: Get the proxy's exit IP by making a request through the proxy
-        try:
-            ip_response = requests.get("https://api.ipify.org?format=json", proxies=proxies, timeout=30)
-            proxy_ip = ip_response.json().get('ip')
-        except:
-            try:
-                ip_response = requests.get("https://httpbin.org/ip", proxies=proxies, timeout=30)
-                proxy_ip = ip_response.json().get('origin', '').split(',')[0].strip()
-            except:
-                return jsonify({"error": "Could not connect through proxy"})
-        
-        if not proxy_ip:
-            return jsonify({"error": "Could not determine proxy exit IP"})
-        
-        # Step 2: Query IP2Location.io with the proxy IP (direct request, not through proxy)
-        ip2_response = requests.get(
-            f"https://api.ip2location.io/?key={ip2location_key}&ip={proxy_ip}",
-            timeout=10
-        )
-        
-        ip_data = ip2_response.json()
-        
-        if 'error' in ip_data:
-            error_msg = ip_data['error'].get('error_message', 'Unknown error') if isinstance(ip_data['error'], dict) else ip_data['error']
-            return jsonify({"error": f"IP2Location error: {error_msg}"})
-        
-        # Get the proxy object from response
-        proxy_obj = ip_data.get('proxy') if ip_data.get('proxy') else {}
-        
-        # Read boolean values - handle both True/False and truthy values
-        def get_bool(obj, key):
-            val = obj.get(key)
-            if val is True:
-                return True
-            if val is False:
-                return False
-            if val is None:
-                return False
-            if isinstance(val, str):
-                return val.lower() in ['true', 'yes', '1']
-            return bool(val)
-        
-        is_proxy = get_bool(ip_data, 'is_proxy')
-        is_vpn = get_bool(proxy_obj, 'is_vpn')
-        is_tor = get_bool(proxy_obj, 'is_tor')
-        is_datacenter = get_bool(proxy_obj, 'is_data_center')
-        is_public_proxy = get_bool(proxy_obj, 'is_public_proxy')
-        is_residential = get_bool(proxy_obj, 'is_residential_proxy')
-        is_web_proxy = get_bool(proxy_obj, 'is_web_proxy')
-        is_web_crawler = get_bool(proxy_obj, 'is_web_crawler')
-        
-        proxy_type = proxy_obj.get('proxy_type') or '-'
-        threat = proxy_obj.get('threat') or '-'
-        provider = proxy_obj.get('provider') or '-'
-        last_seen = proxy_obj.get('last_seen') if proxy_obj.get('last_seen') is not None else '-'
-        fraud_score = ip_data.get('fraud_score') if ip_data.get('fraud_score') is not None else '-'
-        usage_type = ip_data.get('usage_type') or '-'
-        
-        lat = ip_data.get('latitude', 0)
-        lon = ip_data.get('longitude', 0)
-        
-        # Calculate distance
-        distance = haversine_distance(
-            target_coords['lat'], target_coords['lon'],
-            lat, lon
-        )
-        
-        return jsonify({
-            "target_input": target_address,
-            "target_resolved": target_coords['place_name'],
-            "target_lat": target_coords['lat'],
-            "target_lon": target_coords['lon'],
-            "ip": proxy_ip,
-            "country": ip_data.get('country_name', 'Unknown'),
-            "region": ip_data.get('region_name', 'Unknown'),
-            "city": ip_data.get('city_name', 'Unknown'),
-            "actual_lat": lat,
-            "actual_lon": lon,
-            "isp": ip_data.get('isp', 'Unknown'),
-            "org": ip_data.get('as', 'Unknown'),
-            "is_proxy": is_proxy,
-            "is_vpn": is_vpn,
-            "is_tor": is_tor,
-            "is_datacenter": is_datacenter,
-            "is_public_proxy": is_public_proxy,
-            "is_residential": is_residential,
-            "is_web_proxy": is_web_proxy,
-            "is_web_crawler": is_web_crawler,
-            "proxy_type": proxy_type,
-            "usage_type": usage_type,
-            "threat": threat,
-            "provider": provider,
-            "last_seen": last_seen,
-            "fraud_score": fraud_score,
-            "distance_miles": distance,
-            "distance_km": distance * 1.60934,
-            "debug_has_proxy_obj": 'proxy' in ip_data,
-            "debug_is_proxy_raw": ip_data.get('is_proxy'),
-            "debug_proxy_obj": proxy_obj,
-            "debug_ip_queried": proxy_ip,
-            "debug_full_response": ip_data
+        k = int(data.get('k', 5))
+        max_miles = float(data['max_miles']) if data.get('max_miles') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "k and max_miles must be numbers"}), 400
+    if k < 1:
+        return jsonify({"error": "k must be at least 1"}), 400
+    if max_miles is not None and max_miles < 0:
+        return jsonify({"error": "max_miles must not be negative"}), 400
+    
+    try:
+        targets = run_sync(geocode_many_async(target_addresses, mapbox_key))
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    except httpx.HTTPError as e:
+        return jsonify({"error": f"Error: {str(e)}"})
+    
+    ranked = iter(nearest_exits(exits, [t for t in targets if t], k, max_miles, data.get('clean_only', True)))
+    results = []
+    for address, target in zip(target_addresses, targets):
+        if not target:
+            results.append({"target_input": address, "error": "Could not geocode the target address"})
+            continue
+        results.append({
+            "target_input": address,
+            "target_resolved": target['place_name'],
+            "target_lat": target['lat'],
+            "target_lon": target['lon'],
+            "exits": [{
+                "proxy_string": e.get('proxy_string'),
+                "ip": e.get('ip'),
+                "city": e.get('city'),
+                "region": e.get('region'),
+                "country": e.get('country'),
+                "actual_lat": e['actual_lat'],
+                "actual_lon": e['actual_lon'],
+                "distance_miles": distance,
+                "distance_km": distance * 1.60934,
+            } for e, distance in next(ranked)]
         })
-        
+    
+    return jsonify({"results": results})
+
+
+@app.route('/nearest-exits', methods=['POST'])
+def nearest_exits_for_target():
+    """Answer "which known exits are near this address" from the exit index, without probing."""
+    data = request.json
+    target_address = data.get('target_address', '')
+    mapbox_key = data.get('mapbox_key', '')
+    
+    try:
+        max_miles = float(data.get('max_miles', 10))
+        limit = int(data.get('limit', 10))
+        max_age = float(data['max_age_minutes']) * 60 if data.get('max_age_minutes') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_miles, limit and max_age_minutes must be numbers"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    if max_miles < 0:
+        return jsonify({"error": "max_miles must not be negative"}), 400
+    
+    try:
+        target_coords = run_sync(geocode_with_mapbox_async(target_address, mapbox_key))
     except ValueError as e:
         return jsonify({"error": str(e)})
-    except requests.exceptions.Timeout:
-        return jsonify({"error": "Connection timeout - proxy may be unreachable"})
-    except requests.exceptions.ProxyError as e:
-        return jsonify({"error": f"Proxy connection failed - check your proxy credentials"})
-    except Exception as e:
+    except httpx.HTTPError as e:
         return jsonify({"error": f"Error: {str(e)}"})
+    if not target_coords:
+        return jsonify({"error": "Could not geocode the target address. Please check the address and try again."})
+    
+    started = time.perf_counter()
+    found = exit_index.nearest(
+        target_coords['lat'], target_coords['lon'], max_miles, limit,
+        clean_only=data.get('clean_only', True), max_age=max_age
+    )
+    lookup_ms = (time.perf_counter() - started) * 1000
+    
+    return jsonify({
+        "target_input": target_address,
+        "target_resolved": target_coords['place_name'],
+        "target_lat": target_coords['lat'],
+        "target_lon": target_coords['lon'],
+        "exits": found,
+        "lookup_ms": lookup_ms,
+    })
+
+
+# Largest number of stored results returned by one history query
+RESULTS_MAX_LIMIT = 1000
+
+
+def read_limit(args):
+    try:
+        return max(1, min(int(args.get('limit', 100)), RESULTS_MAX_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+
+
+@app.route('/results/recent')
+def recent_results():
+    """Latest stored check results; ``since_minutes`` and ``ok=true|false`` narrow them down."""
+    if result_store is None:
+        return jsonify({"error": "Result history is disabled (RESULT_DB is empty)"})
+    
+    try:
+        limit = read_limit(request.args)
+        since_minutes = request.args.get('since_minutes')
+        since = time.time() - float(since_minutes) * 60 if since_minutes else None
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    ok = request.args.get('ok')
+    if ok is not None:
+        ok = ok.lower() in ('true', '1', 'yes')
+    
+    return jsonify({"results": result_store.recent(limit, since=since, ok=ok)})
+
+
+@app.route('/results/history')
+def proxy_history():
+    """Stored results for one proxy (``proxy`` string, or ``host``/``username``) or one ``exit_ip``."""
+    if result_store is None:
+        return jsonify({"error": "Result history is disabled (RESULT_DB is empty)"})
+    
+    host = request.args.get('host')
+    username = request.args.get('username')
+    exit_ip = request.args.get('exit_ip')
+    try:
+        limit = read_limit(request.args)
+        if request.args.get('proxy'):
+            proxy_info = parse_proxy_string(request.args['proxy'])
+            host, username = proxy_info['host'], proxy_info['username']
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    if not (host or username or exit_ip):
+        return jsonify({"error": "Pass proxy, host, username or exit_ip"})
+    
+    return jsonify({"results": result_store.history(host, username, exit_ip, limit)})
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a sweep to run in the background; returns its ``job_id`` straight away.
+
+    Takes the /check-batch fields (up to JOB_MAX_PROXIES proxies), including
+    ``force``, ``stop_after`` and the rejection rules.
+    """
+    if job_manager is None:
+        return jsonify({"error": "Jobs are disabled (JOB_DB is empty)"})
+    
+    data = request.json
+    try:
+        proxy_strings = read_proxy_strings(data, JOB_MAX_PROXIES)
+        options = {
+            "concurrency": read_concurrency(data),
+            "force": bool(data.get('force', False)),
+            "stop_after": read_stop_after(data),
+        }
+        rules = RejectRules.from_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    if rules is not None:
+        options.update(max_miles=rules.max_miles, clean_only=rules.clean_only,
+                       max_fraud_score=rules.max_fraud_score, exclude_ips=sorted(rules.exclude_ips))
+    
+    job_id = job_manager.submit(
+        proxy_strings, data.get('target_address', ''), data.get('mapbox_key', ''), data.get('ip2location_key', ''), options
+    )
+    return jsonify(job_manager.status(job_id))
+
+
+@app.route('/jobs')
+def list_jobs():
+    if job_manager is None:
+        return jsonify({"error": "Jobs are disabled (JOB_DB is empty)"})
+    try:
+        limit = read_limit(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    return jsonify({"jobs": job_manager.recent(limit)})
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """State and progress of a job: ``checked`` of ``total``, ``succeeded``, ``failed``, ``rejected``."""
+    if job_manager is None:
+        return jsonify({"error": "Jobs are disabled (JOB_DB is empty)"})
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"})
+    return jsonify(status)
+
+
+@app.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    """Results saved so far (all of them once the job is done).
+
+    ``offset``/``limit`` page through them in input order, or closest first
+    with ``sort=distance``; ``ok=true|false`` filters, ``fields`` trims.
+    """
+    if job_manager is None:
+        return jsonify({"error": "Jobs are disabled (JOB_DB is empty)"})
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"})
+    try:
+        limit = read_limit(request.args)
+        offset = int(request.args.get('offset', 0))
+        fields, _ = read_shape(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    ok = request.args.get('ok')
+    if ok is not None:
+        ok = ok.lower() in ('true', '1', 'yes')
+    
+    results = job_manager.results(job_id, offset, limit, request.args.get('sort', 'index'), ok)
+    return json_response(dict(status, offset=offset, results=[dict(shape_result(r, fields), index=r['index']) for r in results]))
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Stop a queued or running job; results saved so far are kept."""
+    if job_manager is None:
+        return jsonify({"error": "Jobs are disabled (JOB_DB is empty)"})
+    if not job_manager.cancel(job_id):
+        status = job_manager.status(job_id)
+        if status is None:
+            return jsonify({"error": "Unknown job"})
+        return jsonify(dict(status, error=status['error'] or f"Job is already {status['state']}"))
+    return jsonify(job_manager.status(job_id))
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify({
+        "geocode": geocode_cache.stats(),
+        "ip_intel": ip_intel_cache.stats(),
+        "result": result_cache.stats(),
+        "exit_index": exit_index.stats(),
+        "result_store": result_store.stats() if result_store is not None else None,
+        "single_flight": {"geocode": geocode_flights.stats(), "ip_intel": ip_intel_flights.stats()},
+    })
+
+
+@app.route('/quota')
+def quota():
+    """This month's upstream API usage and remaining budget per API key (keys shown as fingerprints)."""
+    return jsonify(upstream_limiter.stats())
+
+
+@app.route('/gateway-stats')
+def gateway_stats():
+    """Current adaptive concurrency limit, in-flight probes and latency per proxy gateway."""
+    return jsonify(gateway_limits.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+@app.route('/echo-stats')
+def echo_endpoint_stats():
+    return jsonify(echo_stats())
 
 
 if __name__ == '__main__':
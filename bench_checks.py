@@ -0,0 +1,181 @@
+"""Benchmark check throughput offline, against local stand-ins for every upstream.
+
+Starts benchfakes.py's fake Mapbox / IP2Location.io / IP echo server and fake
+forward proxy in a separate process, points the app at them and drives
+/check (single), /check-batch (batch) and /check-stream (stream) through
+Flask's test client, and shard.check_sharded (sharded) across processes.
+Reports checks/sec, p50/p99 latency and peak memory.
+
+    python bench_checks.py --checks 1000 --concurrency 100
+    python bench_checks.py --modes batch --proxy-latency 200 --proxy-error-rate 0.05 --json
+    python bench_checks.py --modes batch,sharded --processes 16 --checks 20000
+
+Latency is the request round trip for single checks, and each check's own
+pipeline time (``stage_ms.total``) for the other modes. Peak RSS covers this
+process only, not the shards.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchfakes import Faults, run_fakes
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def proxy_strings(mode, count, proxy_port):
+    return [f"bench-{mode}-sessionid-{i}:secret@127.0.0.1:{proxy_port}" for i in range(count)]
+
+
+def run_single(client, proxies, concurrency):
+    def check(proxy_string):
+        started = time.perf_counter()
+        result = client.post('/check', json={"proxy_string": proxy_string, "target_address": "bench target"}).get_json()
+        return result, (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(check, proxies))
+    return [result for result, _ in outcomes], [latency for _, latency in outcomes]
+
+
+def run_batch(client, proxies, concurrency, batch_size):
+    results = []
+    for start in range(0, len(proxies), batch_size):
+        summary = client.post('/check-batch', json={
+            "proxy_strings": proxies[start:start + batch_size],
+            "target_address": "bench target",
+            "concurrency": concurrency,
+        }).get_json()
+        results.extend(summary['results'])
+    return results, [r['stage_ms']['total'] for r in results if 'stage_ms' in r]
+
+
+def run_stream(client, proxies, concurrency, batch_size):
+    results = []
+    for start in range(0, len(proxies), batch_size):
+        response = client.post('/check-stream', json={
+            "proxy_strings": proxies[start:start + batch_size],
+            "target_address": "bench target",
+            "concurrency": concurrency,
+        }, buffered=False)
+        for line in response.response:
+            event = json.loads(line)
+            if event['event'] == 'result':
+                results.append(event['result'])
+    return results, [r['stage_ms']['total'] for r in results if 'stage_ms' in r]
+
+
+def run_sharded(proxies, concurrency, processes):
+    from checker import geocode_with_mapbox
+    from shard import check_sharded
+
+    target_coords = geocode_with_mapbox("bench target", "")
+    results = [result for _, result in check_sharded(
+        enumerate(proxies), "bench target", "", "", target_coords, processes=processes, concurrency=concurrency
+    )]
+    return results, [r['stage_ms']['total'] for r in results if 'stage_ms' in r]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='single,batch,stream', help="comma-separated: single, batch, stream, sharded")
+    parser.add_argument('--checks', type=int, default=500, help="checks per mode")
+    parser.add_argument('--concurrency', type=int, default=50, help="checks at once (per process for sharded)")
+    parser.add_argument('--processes', type=int, default=0, help="sharded: shard processes (default: one per CPU core)")
+    parser.add_argument('--upstream-latency', type=float, default=20, help="ms added by the fake APIs")
+    parser.add_argument('--upstream-error-rate', type=float, default=0.0)
+    parser.add_argument('--proxy-latency', type=float, default=50, help="ms added by the fake proxy")
+    parser.add_argument('--proxy-error-rate', type=float, default=0.0, help="fraction of proxy requests dropped")
+    parser.add_argument('--tracemalloc', action='store_true', help="also report the peak Python heap per mode (slower)")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    ports = multiprocessing.Queue()
+    fakes = multiprocessing.Process(target=run_fakes, daemon=True, args=(
+        Faults(args.upstream_latency / 1000, error_rate=args.upstream_error_rate, seed=1),
+        Faults(args.proxy_latency / 1000, error_rate=args.proxy_error_rate, seed=2),
+        ports,
+    ))
+    fakes.start()
+    upstream_port, proxy_port = ports.get(timeout=10)
+    upstream = f"http://127.0.0.1:{upstream_port}"
+
+    # Configure before the app is imported: module-level settings are read from the environment
+    os.environ.update({
+        "MAPBOX_API_URL": upstream,
+        "IP2LOCATION_API_URL": upstream,
+        "EXIT_IP_ENDPOINTS": f"{upstream}/ip|ip",
+        "RESULT_FRESHNESS": "0",
+        "RESULT_DB": "",
+        "QUOTA_DB": "",
+        "JOB_DB": "",
+        "MAPBOX_RATE_LIMIT": "0",
+        "IP2LOCATION_RATE_LIMIT": "0",
+        "LOG_LEVEL": "WARNING",
+    })
+    from app import BATCH_MAX_PROXIES, app
+
+    client = app.test_client()
+    client.post('/check', json={"proxy_string": f"warmup:secret@127.0.0.1:{proxy_port}", "target_address": "bench target"})
+
+    runners = {
+        "single": lambda proxies: run_single(client, proxies, args.concurrency),
+        "batch": lambda proxies: run_batch(client, proxies, args.concurrency, BATCH_MAX_PROXIES),
+        "stream": lambda proxies: run_stream(client, proxies, args.concurrency, BATCH_MAX_PROXIES),
+        "sharded": lambda proxies: run_sharded(proxies, args.concurrency, args.processes),
+    }
+    report = []
+    for mode in args.modes.split(','):
+        proxies = proxy_strings(mode, args.checks, proxy_port)
+        if args.tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        results, latencies = runners[mode](proxies)
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for r in results if 'error' in r)
+        report.append({
+            "mode": mode,
+            "checks": len(results),
+            "failed": failed,
+            "seconds": round(elapsed, 3),
+            "checks_per_second": round(len(results) / elapsed, 1),
+            "p50_ms": percentile(latencies, 0.50),
+            "p99_ms": percentile(latencies, 0.99),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "peak_heap_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if args.tracemalloc else None,
+        })
+        if args.tracemalloc:
+            tracemalloc.stop()
+
+    fakes.terminate()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{args.checks} checks per mode, concurrency {args.concurrency}, "
+          f"upstream {args.upstream_latency:g} ms / {args.upstream_error_rate:.0%} errors, "
+          f"proxy {args.proxy_latency:g} ms / {args.proxy_error_rate:.0%} dropped")
+    print(f"{'mode':<8}{'checks':>8}{'failed':>8}{'checks/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}"
+          + (f"{'peak heap MB':>14}" if args.tracemalloc else ""))
+    for row in report:
+        print(f"{row['mode']:<8}{row['checks']:>8}{row['failed']:>8}{row['checks_per_second']:>10.1f}"
+              f"{row['p50_ms'] or 0:>10.1f}{row['p99_ms'] or 0:>10.1f}{row['peak_rss_mb']:>13.1f}"
+              + (f"{row['peak_heap_mb']:>14.1f}" if args.tracemalloc else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark the vectorized distance ranking against the scalar haversine_distance.
+
+    python bench_distance.py --exits 5000 --targets 500 --k 5
+"""
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+# Only the distance functions are benchmarked; keep checker from opening its SQLite stores
+os.environ.setdefault('RESULT_DB', '')
+os.environ.setdefault('QUOTA_DB', '')
+
+from checker import haversine_distance
+from ranking import haversine_matrix, nearest_exits
+
+
+def random_points(count, rng):
+    # Roughly the continental US
+    return [{"lat": rng.uniform(25, 49), "lon": rng.uniform(-124, -67)} for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--exits', type=int, default=5000)
+    parser.add_argument('--targets', type=int, default=500)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    exits = [{"actual_lat": p["lat"], "actual_lon": p["lon"]} for p in random_points(args.exits, rng)]
+    targets = random_points(args.targets, rng)
+    pairs = args.exits * args.targets
+    print(f"{args.exits} exits x {args.targets} targets = {pairs:,} pairs, top {args.k}")
+
+    started = time.perf_counter()
+    scalar = [
+        sorted(
+            ((e, haversine_distance(t['lat'], t['lon'], e['actual_lat'], e['actual_lon'])) for e in exits),
+            key=lambda pair: pair[1]
+        )[:args.k]
+        for t in targets
+    ]
+    scalar_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vectorized = nearest_exits(exits, targets, k=args.k)
+    vectorized_time = time.perf_counter() - started
+
+    matrix = haversine_matrix(
+        [t['lat'] for t in targets], [t['lon'] for t in targets],
+        [e['actual_lat'] for e in exits], [e['actual_lon'] for e in exits]
+    )
+    max_error = max(
+        abs(matrix[i, j] - haversine_distance(targets[i]['lat'], targets[i]['lon'], exits[j]['actual_lat'], exits[j]['actual_lon']))
+        for i, j in zip(np.random.default_rng(args.seed).integers(0, args.targets, 1000),
+                        np.random.default_rng(args.seed + 1).integers(0, args.exits, 1000))
+    )
+    same = all(
+        np.allclose([d for _, d in s], [d for _, d in v])
+        for s, v in zip(scalar, vectorized)
+    )
+
+    print(f"scalar:     {scalar_time:8.3f}s  ({pairs / scalar_time:,.0f} pairs/s)")
+    print(f"vectorized: {vectorized_time:8.3f}s  ({pairs / vectorized_time:,.0f} pairs/s)")
+    print(f"speedup:    {scalar_time / vectorized_time:8.1f}x")
+    print(f"max abs difference: {max_error:.2e} miles, same top-{args.k}: {same}")
+
+
+if __name__ == '__main__':
+    main()
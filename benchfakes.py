@@ -0,0 +1,215 @@
+"""Local stand-ins for the services a check talks to, for offline benchmarks.
+
+- ``upstream``: one HTTP server playing the Mapbox geocoding API, the
+  IP2Location.io API and an IP echo service (``/ip``).
+- ``proxy``: an HTTP forward proxy (absolute-form requests and CONNECT
+  tunnels) that requires proxy credentials and gives each username its own
+  stable "exit IP", reported to the echo service in an ``X-Exit-IP`` header.
+
+Both add a configurable latency (with jitter) to every request and fail a
+configurable fraction of them: the upstream answers 503, the proxy drops the
+connection the way an overloaded gateway does. They are deliberately minimal
+HTTP/1.1 implementations (keep-alive, Content-Length bodies only).
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import urllib.parse
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 407: 'Proxy Authentication Required', 503: 'Service Unavailable'}
+
+
+class Faults:
+    """Latency (seconds, +/- ``jitter`` as a fraction) and error rate applied to each request."""
+
+    def __init__(self, latency=0.0, jitter=0.2, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def fail(self):
+        return self._random.random() < self.error_rate
+
+
+async def read_head(reader):
+    """Read a request or response head; returns (start line, headers) or None at EOF."""
+    line = await reader.readline()
+    if not line:
+        return None
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = header.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return line.decode('latin-1').rstrip('\r\n'), headers
+
+
+def json_response(status, payload):
+    body = json.dumps(payload).encode()
+    head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    return head.encode('latin-1') + body
+
+
+def exit_ip_for(username):
+    """A stable fake exit IP per proxy username (session)."""
+    digest = hashlib.sha256(username.encode()).digest()
+    return f"10.{digest[0]}.{digest[1]}.{digest[2] or 1}"
+
+
+def geocode(path):
+    return {"features": [{
+        "geometry": {"coordinates": [-117.0617, 32.7073]},
+        "place_name": urllib.parse.unquote(path.rsplit('/', 1)[-1][:-len('.json')]),
+    }]}
+
+
+def ip_intel(ip):
+    # Exits scattered deterministically around San Diego, a few of them flagged
+    digest = hashlib.sha256(ip.encode()).digest()
+    flagged = digest[4] < 26
+    return {
+        "ip": ip,
+        "country_name": "United States of America",
+        "region_name": "California",
+        "city_name": "San Diego",
+        "latitude": 32.5 + digest[0] / 255 * 0.5,
+        "longitude": -117.3 + digest[1] / 255 * 0.5,
+        "isp": "Bench ISP",
+        "as": "Bench AS",
+        "is_proxy": flagged,
+        "fraud_score": digest[3] % 100,
+        "usage_type": "ISP/MOB",
+        "proxy": {"is_vpn": False, "is_tor": False, "is_data_center": flagged, "is_residential_proxy": flagged},
+    }
+
+
+async def serve_upstream(faults, host='127.0.0.1', port=0):
+    """Start the fake Mapbox / IP2Location.io / IP echo server; returns the asyncio server."""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await read_head(reader)
+                if head is None:
+                    break
+                request_line, headers = head
+                _, target, _ = request_line.split(' ', 2)
+                url = urllib.parse.urlsplit(target)
+                query = urllib.parse.parse_qs(url.query)
+                await faults.delay()
+                if faults.fail():
+                    writer.write(json_response(503, {"error": "injected failure"}))
+                elif url.path.startswith('/geocoding/v5/mapbox.places/'):
+                    writer.write(json_response(200, geocode(url.path)))
+                elif url.path == '/ip':
+                    writer.write(json_response(200, {"ip": headers.get('x-exit-ip') or writer.get_extra_info('peername')[0]}))
+                elif 'ip' in query:
+                    writer.write(json_response(200, ip_intel(query['ip'][0])))
+                else:
+                    writer.write(json_response(404, {"error": "not found"}))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, backlog=4096)
+
+
+async def _pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _relay_response(reader, writer):
+    """Copy one Content-Length response from ``reader`` to ``writer``."""
+    head = await read_head(reader)
+    if head is None:
+        raise ConnectionError("upstream closed the connection")
+    status_line, headers = head
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    lines = [status_line] + [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+
+async def serve_proxy(faults, host='127.0.0.1', port=0):
+    """Start the fake forward proxy; returns the asyncio server."""
+
+    async def handle(reader, writer):
+        upstreams = {}
+        try:
+            while True:
+                head = await read_head(reader)
+                if head is None:
+                    break
+                request_line, headers = head
+                method, target, version = request_line.split(' ', 2)
+                credentials = headers.pop('proxy-authorization', '')
+                if not credentials.lower().startswith('basic '):
+                    writer.write(json_response(407, {"error": "proxy credentials required"}))
+                    await writer.drain()
+                    continue
+                username = base64.b64decode(credentials[6:]).decode().partition(':')[0]
+
+                await faults.delay()
+                if faults.fail():
+                    break
+
+                if method == 'CONNECT':
+                    target_host, _, target_port = target.rpartition(':')
+                    up_reader, up_writer = await asyncio.open_connection(target_host, int(target_port))
+                    writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+                    await writer.drain()
+                    await asyncio.gather(_pipe(reader, up_writer), _pipe(up_reader, writer))
+                    return
+
+                url = urllib.parse.urlsplit(target)
+                address = (url.hostname, url.port or 80)
+                if address not in upstreams:
+                    upstreams[address] = await asyncio.open_connection(*address)
+                up_reader, up_writer = upstreams[address]
+                headers['x-exit-ip'] = exit_ip_for(username)
+                headers.pop('proxy-connection', None)
+                path = url.path + ('?' + url.query if url.query else '')
+                lines = [f"{method} {path or '/'} {version}"] + [f"{name}: {value}" for name, value in headers.items()]
+                up_writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+                await _relay_response(up_reader, writer)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            for _, up_writer in upstreams.values():
+                up_writer.close()
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, backlog=4096)
+
+
+def run_fakes(upstream_faults, proxy_faults, ports):
+    """Process entry point: start both servers and report their ports on the ``ports`` queue."""
+
+    async def main():
+        upstream = await serve_upstream(upstream_faults)
+        proxy = await serve_proxy(proxy_faults)
+        ports.put((upstream.sockets[0].getsockname()[1], proxy.sockets[0].getsockname()[1]))
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+"""In-memory LRU cache with per-entry TTL and optional SQLite persistence,
+and single-flight coalescing of concurrent lookups that miss it."""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from writer import BackgroundWriter
+
+# Returned by TTLCache.get() when a key is absent or expired, so None can be cached
+MISSING = object()
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after ``ttl`` seconds.
+
+    If ``path`` is given, entries are also written to a SQLite table so they
+    survive restarts; the memory layer stays the source of truth for LRU order
+    and falls back to SQLite on a miss. Writes are queued and made in batches
+    by a ``BackgroundWriter`` (writer.py), and after each batch the
+    table is cleared of expired rows and trimmed to ``maxsize`` (soonest to
+    expire first). Values must be JSON serialisable.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, path=None, table='cache', batch_size=200, flush_interval=1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._reader = None
+        self._reader_pid = None
+        self._writer = None
+        if path:
+            db = self._connect()
+            db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires)")
+            db.execute(f"DELETE FROM {table} WHERE expires <= ?", (time.time(),))
+            db.commit()
+            db.close()
+            self._writer = BackgroundWriter(self._connect, self._apply, f'{table}-writer', batch_size, flush_interval)
+
+    def get(self, key, default=MISSING):
+        """Return the cached value for ``key``, or ``default`` if absent or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None and self.path:
+                row = self._read_db().execute(
+                    f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    entry = (json.loads(row[0]), row[1])
+                    self._store(key, entry)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._delete(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Cache ``value`` under ``key`` for ``ttl`` seconds (defaults to the cache TTL)."""
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, (value, expires))
+        if self.path:
+            self._writer.put(('set', key, json.dumps(value), expires))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self.path:
+            self._writer.put(('clear',))
+
+    def flush(self):
+        """Block until every queued write is on disk."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def stats(self):
+        """Return hit/miss counters and size information."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "persistent": bool(self.path),
+                "queued": self._writer.queued() if self._writer else 0,
+                "failed_writes": self._writer.failed if self._writer else 0,
+            }
+
+    def _store(self, key, entry):
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def _delete(self, key):
+        self._data.pop(key, None)
+        if self.path:
+            self._writer.put(('delete', key))
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def _read_db(self):
+        # SQLite connections must not be shared across a fork, so each process opens its own
+        if self._reader_pid != os.getpid():
+            self._reader = self._connect()
+            self._reader_pid = os.getpid()
+        return self._reader
+
+    def _apply(self, db, ops):
+        for op in ops:
+            if op[0] == 'set':
+                db.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)", op[1:])
+            elif op[0] == 'delete':
+                db.execute(f"DELETE FROM {self.table} WHERE key = ?", op[1:])
+            else:
+                db.execute(f"DELETE FROM {self.table}")
+        db.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (time.time(),))
+        db.execute(
+            f"DELETE FROM {self.table} WHERE key IN "
+            f"(SELECT key FROM {self.table} ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,)
+        )
+
+
+class _Flight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent async calls with the same key into one in-flight call.
+
+    The first caller for a key starts the call; callers arriving while it runs
+    wait for the same outcome (result or exception) instead of starting their
+    own, so upstream fan-out is capped at the number of distinct keys. A
+    cancelled caller doesn't cancel the call for the others; the call is only
+    cancelled once every caller has gone. It runs in the first caller's
+    context (trace ID, timings).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+
+    async def do(self, key, make_call):
+        """Return the outcome of ``make_call()``, sharing one call among concurrent callers with ``key``."""
+        flight_key = (asyncio.get_running_loop(), key)
+        flight = self._flights.get(flight_key)
+        if flight is None:
+            flight = self._flights[flight_key] = _Flight(asyncio.ensure_future(make_call()))
+            flight.task.add_done_callback(lambda task: self._landed(flight_key, flight))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Everyone went away: drop the call, and let the next caller start a fresh one
+                self._forget(flight_key, flight)
+                flight.task.cancel()
+
+    def _landed(self, flight_key, flight):
+        self._forget(flight_key, flight)
+        # Mark a failure as retrieved even if every caller was cancelled just before it
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def _forget(self, flight_key, flight):
+        if self._flights.get(flight_key) is flight:
+            del self._flights[flight_key]
+
+    def stats(self):
+        calls = self.calls + self.coalesced
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / calls if calls else 0.0,
+            "in_flight": len(self._flights),
+        }
@@ -0,0 +1,727 @@
+"""Proxy check pipeline.
+
+All network I/O goes through httpx's async client so a single process can keep
+many proxy probes in flight. The coroutines run on one long-lived engine event
+loop; synchronous callers (Flask routes, scripts) hand work to it via run_sync().
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import queue
+import re
+import threading
+import time
+import urllib.parse
+
+import httpx
+
+from cache import MISSING, SingleFlight, TTLCache
+from clients import fetch, get_client_pool
+from concurrency import GatewayLimits
+from exitip import ProxyRefused, ProxyTimeout, ProxyUnreachable, discover_exit_ip
+from exits import ExitIndex
+from history import ResultStore
+from ipintel import load_backend
+from metrics import CHECK_OUTCOMES, CHECK_SECONDS, CHECKS_IN_FLIGHT, STAGE_SECONDS, register_stats
+from ratelimit import QuotaExceeded, UpstreamLimiter, key_fingerprint
+from rules import Rejected
+from tracing import trace
+
+logger = logging.getLogger('proxy_checker')
+
+# Batch checks: default/maximum number of proxies probed at once, and batch size limit
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 20))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 500))
+BATCH_MAX_PROXIES = int(os.environ.get('BATCH_MAX_PROXIES', 1000))
+
+# Geocoded target addresses, keyed by normalized address. Set GEOCODE_CACHE_DB to persist them.
+geocode_cache = TTLCache(
+    maxsize=int(os.environ.get('GEOCODE_CACHE_SIZE', 1024)),
+    ttl=int(os.environ.get('GEOCODE_CACHE_TTL', 7 * 24 * 3600)),
+    path=os.environ.get('GEOCODE_CACHE_DB') or None,
+    table='geocode_cache',
+)
+
+# Concurrent lookups of the same address or exit IP that miss the caches share one upstream call
+geocode_flights = SingleFlight()
+ip_intel_flights = SingleFlight()
+
+# Base URL of the Mapbox API (override to point at a compatible stand-in, e.g. for bench_checks.py)
+MAPBOX_API_URL = os.environ.get('MAPBOX_API_URL', 'https://api.mapbox.com').rstrip('/')
+
+# Successful check results, keyed by proxy string and target, reused for RESULT_FRESHNESS seconds
+# unless the caller forces a live check (0 disables reuse). Set RESULT_CACHE_DB to persist them.
+RESULT_FRESHNESS = int(os.environ.get('RESULT_FRESHNESS', 300))
+result_cache = TTLCache(
+    maxsize=int(os.environ.get('RESULT_CACHE_SIZE', 10000)),
+    ttl=RESULT_FRESHNESS,
+    path=os.environ.get('RESULT_CACHE_DB') or None,
+    table='result_cache',
+)
+
+# Exits seen by successful checks, for nearest-exit queries. Set EXIT_INDEX_DB to persist them
+# (the file holds full proxy strings, passwords included). 0 disables either bound.
+exit_index = ExitIndex(
+    path=os.environ.get('EXIT_INDEX_DB') or None,
+    cell_degrees=float(os.environ.get('EXIT_INDEX_CELL_DEGREES', 0.25)),
+    max_size=int(os.environ.get('EXIT_INDEX_SIZE', 100000)),
+    max_age=int(os.environ.get('EXIT_INDEX_MAX_AGE', 7 * 24 * 3600)),
+)
+
+# Every check result, for recent-result and per-proxy history queries. Set RESULT_DB= (empty) to disable.
+RESULT_DB = os.environ.get('RESULT_DB', 'results.db')
+result_store = ResultStore(RESULT_DB) if RESULT_DB else None
+
+# Where exit IPs are looked up: ip2location-api (default), ip2location-bin or mmdb (IP_INTEL_DB file)
+ip_intel_backend = load_backend(
+    os.environ.get('IP_INTEL_BACKEND', 'ip2location-api'),
+    os.environ.get('IP_INTEL_DB') or None,
+)
+
+# Parsed IP2Location.io responses, keyed by exit IP. Set IP_INTEL_CACHE_DB to persist them.
+ip_intel_cache = TTLCache(
+    maxsize=int(os.environ.get('IP_INTEL_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('IP_INTEL_CACHE_TTL', 24 * 3600)),
+    path=os.environ.get('IP_INTEL_CACHE_DB') or None,
+    table='ip_intel_cache',
+)
+# Error responses (bad key, quota exceeded, ...) are cached for a much shorter time
+IP_INTEL_NEGATIVE_TTL = int(os.environ.get('IP_INTEL_NEGATIVE_TTL', 300))
+
+# Upstream API pacing (requests/second per API key) and monthly budgets; 0 disables a limit.
+# Call counts are kept in QUOTA_DB (empty = memory only) so budgets survive restarts.
+QUOTA_DB = os.environ.get('QUOTA_DB', 'quota.db')
+upstream_limiter = UpstreamLimiter(
+    {
+        "mapbox": (
+            float(os.environ.get('MAPBOX_RATE_LIMIT', 10)),
+            int(os.environ.get('MAPBOX_MONTHLY_QUOTA', 100000)),
+        ),
+        "ip2location": (
+            float(os.environ.get('IP2LOCATION_RATE_LIMIT', 10)),
+            int(os.environ.get('IP2LOCATION_MONTHLY_QUOTA', 50000)),
+        ),
+    },
+    path=QUOTA_DB or None,
+)
+
+# Adaptive limit on simultaneous exit-IP probes per proxy gateway (host:port); a probe whose
+# echo requests all timed out, or that the proxy refused, halves it, healthy probes grow it.
+# Set all three equal for a fixed limit.
+gateway_limits = GatewayLimits(
+    (ProxyTimeout, ProxyRefused),
+    initial=int(os.environ.get('PROXY_CONCURRENCY_INITIAL', 8)),
+    min_limit=int(os.environ.get('PROXY_CONCURRENCY_MIN', 1)),
+    max_limit=int(os.environ.get('PROXY_CONCURRENCY_MAX', 200)),
+)
+
+register_stats(
+    {"geocode": geocode_cache, "ip_intel": ip_intel_cache, "result": result_cache},
+    gateway_limits,
+    {"geocode": geocode_flights, "ip_intel": ip_intel_flights},
+)
+
+_engine_loop = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+def get_engine_loop():
+    """Return the process-wide engine event loop, starting it on first use.
+
+    The loop runs in a daemon thread. It is recreated after a fork (e.g. when
+    gunicorn preloads the app) because the thread does not survive it.
+    """
+    global _engine_loop, _engine_pid
+    with _engine_lock:
+        if _engine_loop is None or _engine_pid != os.getpid():
+            _engine_loop = asyncio.new_event_loop()
+            _engine_pid = os.getpid()
+            threading.Thread(target=_engine_loop.run_forever, name='check-engine', daemon=True).start()
+        return _engine_loop
+
+
+def run_sync(coro):
+    """Run a coroutine on the engine loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, get_engine_loop()).result()
+
+
+def iter_events(start):
+    """Run ``start(emit)`` on the engine loop and yield each event it emits as soon as it is emitted.
+
+    ``start`` receives an ``emit(event)`` callback and must return a coroutine.
+    Closing the generator early (e.g. the HTTP client went away) cancels the work.
+    """
+    events = queue.Queue()
+    done = object()
+
+    async def runner():
+        try:
+            await start(events.put)
+        finally:
+            events.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(runner(), get_engine_loop())
+    try:
+        while True:
+            event = events.get()
+            if event is done:
+                break
+            yield event
+        future.result()
+    finally:
+        future.cancel()
+
+
+def parse_proxy_string(proxy_string):
+    """Parse a SOAX-style proxy string."""
+    result = {
+        "claimed_country": None,
+        "claimed_region": None,
+        "claimed_city": None,
+        "username": None,
+        "password": None,
+        "host": None,
+        "port": None,
+    }
+
+    match = re.match(r'^(.+):(.+)@(.+):(\d+)$', proxy_string)
+    if not match:
+        raise ValueError("Invalid proxy string format. Expected: username:password@host:port")
+
+    result["username"] = match.group(1)
+    result["password"] = match.group(2)
+    result["host"] = match.group(3)
+    result["port"] = int(match.group(4))
+
+    username = result["username"]
+
+    country_match = re.search(r'country-([a-z]+)', username, re.IGNORECASE)
+    if country_match:
+        result["claimed_country"] = country_match.group(1).upper()
+
+    region_match = re.search(r'region-([a-z\+]+)', username, re.IGNORECASE)
+    if region_match:
+        result["claimed_region"] = region_match.group(1).replace('+', ' ').title()
+
+    city_match = re.search(r'city-([a-z\+]+)', username, re.IGNORECASE)
+    if city_match:
+        result["claimed_city"] = city_match.group(1).replace('+', ' ').title()
+
+    return result
+
+
+def normalize_address(address):
+    """Normalize an address for cache lookups: case, punctuation and whitespace are ignored."""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', address.lower()).split())
+
+
+async def geocode_with_mapbox_async(address, api_key):
+    """Geocode an address using Mapbox Geocoding API.
+
+    Successful lookups are served from ``geocode_cache`` until they expire.
+    Concurrent misses for the same address and key share one Mapbox call
+    (``geocode_flights``). Every request to Mapbox, retries included, is
+    paced and counted by ``upstream_limiter``.
+    """
+    cache_key = normalize_address(address)
+    cached = geocode_cache.get(cache_key)
+    if cached is not MISSING:
+        return cached
+
+    return await geocode_flights.do(
+        (cache_key, key_fingerprint(api_key)), lambda: _fetch_geocode(address, cache_key, api_key)
+    )
+
+
+async def _fetch_geocode(address, cache_key, api_key):
+    url = MAPBOX_API_URL + "/geocoding/v5/mapbox.places/{}.json".format(
+        urllib.parse.quote(address)
+    )
+    params = {
+        "access_token": api_key,
+        "limit": 1
+    }
+
+    response = await fetch(
+        url, params=params, timeout=10, label='geocode', pace=lambda: upstream_limiter.acquire("mapbox", api_key)
+    )
+    data = response.json()
+
+    if response.status_code == 401:
+        raise ValueError("Invalid Mapbox API key")
+
+    if "features" not in data or len(data["features"]) == 0:
+        return None
+
+    feature = data["features"][0]
+    coords = feature["geometry"]["coordinates"]
+
+    result = {
+        "lat": coords[1],
+        "lon": coords[0],
+        "place_name": feature["place_name"],
+    }
+    geocode_cache.set(cache_key, result)
+    return result
+
+
+async def geocode_many_async(addresses, api_key):
+    """Geocode several addresses concurrently; addresses that cannot be found come back as None.
+
+    A bad key or quota (ValueError) and a Mapbox transport error (httpx.HTTPError)
+    are raised, since they would fail every address alike.
+    """
+    results = await asyncio.gather(
+        *(geocode_with_mapbox_async(address, api_key) for address in addresses),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, (ValueError, httpx.HTTPError)):
+            raise result
+    return [None if isinstance(result, Exception) else result for result in results]
+
+
+def geocode_with_mapbox(address, api_key):
+    """Geocode an address using Mapbox Geocoding API."""
+    return run_sync(geocode_with_mapbox_async(address, api_key))
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two points in miles."""
+    R = 3959
+    lat1_rad, lat2_rad = math.radians(lat1), math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+
+    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    return R * c
+
+
+def get_bool(obj, key):
+    """Read a boolean flag from IP2Location data - handle both True/False and truthy values."""
+    val = obj.get(key)
+    if val is True:
+        return True
+    if val is False:
+        return False
+    if val is None:
+        return False
+    if isinstance(val, str):
+        return val.lower() in ['true', 'yes', '1']
+    return bool(val)
+
+
+async def get_exit_ip_async(proxy_info):
+    """Return the proxy's exit IP by racing the IP echo services through the proxy.
+
+    Returns None if the echo services gave no IP, and raises ConnectionError
+    if none of them could be reached through the proxy.
+    """
+    proxy_url = f"http://{proxy_info['username']}:{proxy_info['password']}@{proxy_info['host']}:{proxy_info['port']}"
+
+    return await discover_exit_ip(get_client_pool().for_proxy(proxy_url))
+
+
+async def lookup_ip_intel_async(ip, api_key):
+    """Look an IP up with the configured IP intel backend and return the parsed response.
+
+    Remote responses are cached by IP in ``ip_intel_cache``. Error responses
+    are cached for IP_INTEL_NEGATIVE_TTL seconds and only reused for the same
+    API key, since they are usually about the key rather than the IP. Local
+    database backends are fast enough to skip the cache. Concurrent misses
+    for the same IP and key share one call (``ip_intel_flights``). Every
+    remote request, retries included, is paced and counted by
+    ``upstream_limiter``.
+    """
+    if not ip_intel_backend.remote:
+        return await ip_intel_backend.lookup(ip)
+
+    key_id = key_fingerprint(api_key)
+    cached = ip_intel_cache.get(ip)
+    if cached is not MISSING and cached["error_key"] in (None, key_id):
+        return cached["data"]
+
+    return await ip_intel_flights.do((ip, key_id), lambda: _fetch_ip_intel(ip, api_key, key_id))
+
+
+async def _fetch_ip_intel(ip, api_key, key_id):
+    try:
+        ip_data = await ip_intel_backend.lookup(ip, api_key, pace=lambda: upstream_limiter.acquire("ip2location", api_key))
+    except QuotaExceeded as e:
+        ip_data = {"error": {"error_message": str(e)}}
+
+    if 'error' in ip_data:
+        ip_intel_cache.set(ip, {"data": ip_data, "error_key": key_id}, ttl=IP_INTEL_NEGATIVE_TTL)
+    else:
+        ip_intel_cache.set(ip, {"data": ip_data, "error_key": None})
+    return ip_data
+
+
+def _ignore_event(event):
+    pass
+
+
+def result_cache_key(proxy_string, target_address):
+    # Hashed so proxy passwords never end up in the cache database
+    return hashlib.sha256(f"{proxy_string}\n{normalize_address(target_address)}".encode()).hexdigest()
+
+
+async def run_check_async(proxy_string, target_address, mapbox_key, ip2location_key, target_coords=None, on_event=None, force=False, timings=False, rules=None):
+    """Check one proxy against a target address.
+
+    Returns the result dict served by /check, or {"error": ...} on failure.
+    Pass ``target_coords`` to reuse an already geocoded target (batch checks).
+    ``on_event`` is called with a dict as each stage finishes: ``geocoded``,
+    ``exit_ip`` and ``ip_intel``. Geocoding runs concurrently with the exit-IP
+    probe and IP lookup; per-stage durations are returned in ``stage_ms``.
+
+    A successful result for the same proxy string and target younger than
+    RESULT_FRESHNESS seconds is returned without probing (a ``cached`` event
+    instead of the stage events) unless ``force`` is set. ``cached`` in the
+    result tells the two apart. Live exits are added to ``exit_index``; every
+    live result is recorded in ``result_store``.
+
+    Each check gets a ``trace_id`` that tags its log lines. With ``timings``
+    the result also lists every upstream HTTP call with its phase durations.
+
+    ``rules`` (a RejectRules) end the check as soon as a rule fails, skipping
+    the stages still pending; the result is then an error tagged ``rejected``.
+    """
+    try:
+        proxy_info = parse_proxy_string(proxy_string)
+    except ValueError:
+        proxy_info = None
+    proxy_label = f"{proxy_info['username']}@{proxy_info['host']}:{proxy_info['port']}" if proxy_info else "invalid proxy string"
+
+    with trace(collect_timings=timings) as (trace_id, calls):
+        cache_key = result_cache_key(proxy_string, target_address)
+        if RESULT_FRESHNESS > 0 and not force:
+            cached = result_cache.get(cache_key)
+            if cached is not MISSING:
+                age = round(time.time() - cached["checked_at"], 1)
+                (on_event or _ignore_event)({"event": "cached", "age_seconds": age})
+                CHECK_OUTCOMES.labels('cached').inc()
+                logger.info("%s: reused a result from %.0fs ago", proxy_label, age)
+                result = dict(cached["result"], target_input=target_address)
+                if rules is not None:
+                    try:
+                        rules.check_result(result)
+                    except Rejected as e:
+                        result = e.as_result()
+                result.update(cached=True, cached_age_seconds=age, trace_id=trace_id)
+                if timings:
+                    result["timings"] = calls
+                return result
+
+        started = time.monotonic()
+        with CHECKS_IN_FLIGHT.track_inprogress():
+            result = await _check_async(proxy_string, target_address, mapbox_key, ip2location_key, target_coords, on_event, rules)
+        elapsed = time.monotonic() - started
+        CHECK_SECONDS.observe(elapsed)
+
+        if 'rejected' in result:
+            logger.info("%s: rejected in %.0f ms: %s", proxy_label, elapsed * 1000, result['error'])
+        elif 'error' in result:
+            logger.info("%s: failed in %.0f ms: %s", proxy_label, elapsed * 1000, result['error'])
+        else:
+            logger.info("%s: exit %s, %.1f miles from target, in %.0f ms", proxy_label, result['ip'], result['distance_miles'], elapsed * 1000)
+            if RESULT_FRESHNESS > 0:
+                result_cache.set(cache_key, {"result": dict(result), "checked_at": time.time()})
+            exit_index.add(proxy_string, result)
+        result["cached"] = False
+        result["trace_id"] = trace_id
+        if timings:
+            result["timings"] = calls
+        if result_store is not None:
+            result_store.record(proxy_info, target_address, result)
+        return result
+
+
+def exit_details(proxy_ip, ip_data):
+    """The exit's location, network and detection flags from an IP intel response, as result fields."""
+    # Get the proxy object from response
+    proxy_obj = ip_data.get('proxy') if ip_data.get('proxy') else {}
+
+    return {
+        "ip": proxy_ip,
+        "country": ip_data.get('country_name', 'Unknown'),
+        "region": ip_data.get('region_name', 'Unknown'),
+        "city": ip_data.get('city_name', 'Unknown'),
+        "actual_lat": ip_data.get('latitude', 0),
+        "actual_lon": ip_data.get('longitude', 0),
+        "isp": ip_data.get('isp', 'Unknown'),
+        "org": ip_data.get('as', 'Unknown'),
+        "is_proxy": get_bool(ip_data, 'is_proxy'),
+        "is_vpn": get_bool(proxy_obj, 'is_vpn'),
+        "is_tor": get_bool(proxy_obj, 'is_tor'),
+        "is_datacenter": get_bool(proxy_obj, 'is_data_center'),
+        "is_public_proxy": get_bool(proxy_obj, 'is_public_proxy'),
+        "is_residential": get_bool(proxy_obj, 'is_residential_proxy'),
+        "is_web_proxy": get_bool(proxy_obj, 'is_web_proxy'),
+        "is_web_crawler": get_bool(proxy_obj, 'is_web_crawler'),
+        "proxy_type": proxy_obj.get('proxy_type') or '-',
+        "usage_type": ip_data.get('usage_type') or '-',
+        "threat": proxy_obj.get('threat') or '-',
+        "provider": proxy_obj.get('provider') or '-',
+        "last_seen": proxy_obj.get('last_seen') if proxy_obj.get('last_seen') is not None else '-',
+        "fraud_score": ip_data.get('fraud_score') if ip_data.get('fraud_score') is not None else '-',
+    }
+
+
+async def _check_async(proxy_string, target_address, mapbox_key, ip2location_key, target_coords, on_event, rules):
+    emit = on_event or _ignore_event
+    stage_ms = {}
+    started = time.monotonic()
+
+    async def timed(stage, coro):
+        stage_started = time.monotonic()
+        try:
+            return await coro
+        finally:
+            elapsed = time.monotonic() - stage_started
+            stage_ms[stage] = round(elapsed * 1000, 1)
+            STAGE_SECONDS.labels(stage).observe(elapsed)
+
+    async def probe():
+        # Step 1: Get the proxy's exit IP by making a request through the proxy,
+        # once the gateway's adaptive concurrency limit has room for another session
+        async with gateway_limits.slot(f"{proxy_info['host']}:{proxy_info['port']}"):
+            proxy_ip = await timed('exit_ip', get_exit_ip_async(proxy_info))
+        if not proxy_ip:
+            return None, None, None
+        emit({"event": "exit_ip", "ip": proxy_ip})
+        if rules is not None:
+            rules.check_exit_ip(proxy_ip)
+
+        # Step 2: Look the proxy IP up (IP2Location.io direct request, not through proxy, or a local database)
+        ip_data = await timed('ip_intel', lookup_ip_intel_async(proxy_ip, ip2location_key))
+        if 'error' in ip_data:
+            return proxy_ip, ip_data, None
+        details = exit_details(proxy_ip, ip_data)
+        emit({
+            "event": "ip_intel",
+            "ip": proxy_ip,
+            "city": details['city'],
+            "region": details['region'],
+            "country": details['country'],
+            "lat": details['actual_lat'],
+            "lon": details['actual_lon'],
+        })
+        if rules is not None:
+            rules.check_exit(details)
+            if target_coords is not None:
+                rules.check_distance(distance_to(details), details)
+        return proxy_ip, ip_data, details
+
+    def distance_to(details):
+        return haversine_distance(target_coords['lat'], target_coords['lon'], details['actual_lat'], details['actual_lon'])
+
+    probe_task = None
+    geocode_task = None
+    try:
+        # Parse proxy string
+        proxy_info = parse_proxy_string(proxy_string)
+
+        # The proxy probe does not depend on the target, so it runs while the target is geocoded
+        probe_task = asyncio.ensure_future(probe())
+
+        # Geocode target address with Mapbox
+        if target_coords is None:
+            geocode_task = asyncio.ensure_future(timed('geocode', geocode_with_mapbox_async(target_address, mapbox_key)))
+            if rules is not None:
+                # A rule may reject the exit before the target is resolved; then the geocode isn't waited for
+                await asyncio.wait([geocode_task, probe_task], return_when=asyncio.FIRST_COMPLETED)
+                if probe_task.done() and isinstance(probe_task.exception(), Rejected):
+                    raise probe_task.exception()
+            target_coords = await geocode_task
+            if target_coords:
+                emit({"event": "geocoded", "target": target_coords})
+        if not target_coords:
+            CHECK_OUTCOMES.labels('geocode_error').inc()
+            return {"error": "Could not geocode the target address. Please check the address and try again."}
+
+        proxy_ip, ip_data, details = await probe_task
+
+        if not proxy_ip:
+            CHECK_OUTCOMES.labels('no_exit_ip').inc()
+            return {"error": "Could not determine proxy exit IP"}
+
+        if 'error' in ip_data:
+            error_msg = ip_data['error'].get('error_message', 'Unknown error') if isinstance(ip_data['error'], dict) else ip_data['error']
+            CHECK_OUTCOMES.labels('ip_intel_error').inc()
+            return {"error": f"IP2Location error: {error_msg}"}
+
+        # Calculate distance
+        distance = distance_to(details)
+        if rules is not None:
+            rules.check_distance(distance, details)
+
+        CHECK_OUTCOMES.labels('success').inc()
+
+        return {
+            "target_input": target_address,
+            "target_resolved": target_coords['place_name'],
+            "target_lat": target_coords['lat'],
+            "target_lon": target_coords['lon'],
+            **details,
+            "distance_miles": distance,
+            "distance_km": distance * 1.60934,
+            "stage_ms": dict(stage_ms, total=round((time.monotonic() - started) * 1000, 1)),
+            "debug_has_proxy_obj": 'proxy' in ip_data,
+            "debug_is_proxy_raw": ip_data.get('is_proxy'),
+            "debug_proxy_obj": ip_data.get('proxy') if ip_data.get('proxy') else {},
+            "debug_ip_queried": proxy_ip,
+            "debug_full_response": ip_data
+        }
+
+    except Rejected as e:
+        CHECK_OUTCOMES.labels('rejected').inc()
+        return dict(e.as_result(), stage_ms=dict(stage_ms, total=round((time.monotonic() - started) * 1000, 1)))
+    except ProxyUnreachable as e:
+        CHECK_OUTCOMES.labels(e.kind).inc()
+        return {"error": str(e)}
+    except QuotaExceeded as e:
+        CHECK_OUTCOMES.labels('quota_exceeded').inc()
+        return {"error": str(e)}
+    except ValueError as e:
+        CHECK_OUTCOMES.labels('invalid').inc()
+        return {"error": str(e)}
+    except ConnectionError as e:
+        CHECK_OUTCOMES.labels('connection_error').inc()
+        return {"error": str(e)}
+    except httpx.TimeoutException:
+        CHECK_OUTCOMES.labels('upstream_timeout').inc()
+        return {"error": "Upstream API timeout - Mapbox or IP2Location.io did not answer in time"}
+    except Exception as e:
+        CHECK_OUTCOMES.labels('error').inc()
+        return {"error": f"Error: {str(e)}"}
+    finally:
+        for task in (probe_task, geocode_task):
+            if task is not None:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+
+# Left out of responses unless verbose: the raw IP intel response and intermediate values parsed from it
+DEBUG_FIELDS = (
+    "debug_has_proxy_obj", "debug_is_proxy_raw", "debug_proxy_obj", "debug_ip_queried", "debug_full_response",
+)
+
+
+def shape_result(result, fields=None, verbose=False):
+    """Trim a check result for a response.
+
+    With ``fields`` only those keys are kept (plus ``error`` and
+    ``proxy_string``, so failures and batch rows stay identifiable);
+    otherwise the debug fields are dropped unless ``verbose``.
+    """
+    if fields:
+        return {key: value for key, value in result.items() if key in fields or key in ('error', 'proxy_string')}
+    if verbose:
+        return result
+    return {key: value for key, value in result.items() if key not in DEBUG_FIELDS}
+
+
+def run_check(proxy_string, target_address, mapbox_key, ip2location_key, target_coords=None, force=False, timings=False, rules=None):
+    """Synchronous wrapper around run_check_async()."""
+    return run_sync(run_check_async(proxy_string, target_address, mapbox_key, ip2location_key, target_coords, force=force, timings=timings, rules=rules))
+
+
+async def run_batch_async(proxy_strings, target_address, mapbox_key, ip2location_key, concurrency=BATCH_CONCURRENCY, on_event=None, force=False, timings=False,
+                          rules=None, stop_after=None):
+    """Check many proxies against one target address, at most ``concurrency`` at a time.
+
+    The target is geocoded once up front. Successful results are ranked by
+    distance (closest first), failed checks follow in input order.
+    ``on_event`` receives ``geocoded`` once, the per-stage events of every
+    proxy tagged with its ``index``, a ``result`` event per finished proxy
+    and a final ``done`` event with the totals. ``force``, ``timings`` and
+    ``rules`` are passed on to every check.
+
+    With ``stop_after`` the batch ends once that many proxies have passed:
+    checks still running are cancelled and the rest are never started, so
+    they cost neither time nor API quota. They are counted as ``skipped``,
+    and so are checks that finish in the same moment as the last pass
+    needed, so exactly ``stop_after`` passes are reported.
+    """
+    emit = on_event or _ignore_event
+    try:
+        with STAGE_SECONDS.labels('geocode').time():
+            target_coords = await geocode_with_mapbox_async(target_address, mapbox_key)
+    except ValueError as e:
+        return {"error": str(e)}
+    except httpx.HTTPError as e:
+        return {"error": f"Error: {str(e)}"}
+    if not target_coords:
+        return {"error": "Could not geocode the target address. Please check the address and try again."}
+    emit({"event": "geocoded", "target": target_coords})
+
+    limit = max(1, min(concurrency, BATCH_MAX_CONCURRENCY, len(proxy_strings)))
+    semaphore = asyncio.Semaphore(limit)
+    passed = 0
+    enough = asyncio.Event()
+
+    async def check_one(index, proxy_string):
+        nonlocal passed
+        async with semaphore:
+            result = await run_check_async(
+                proxy_string, target_address, mapbox_key, ip2location_key, target_coords,
+                on_event=lambda event: emit(dict(event, index=index)), force=force, timings=timings, rules=rules
+            )
+        if enough.is_set():
+            return None
+        result["proxy_string"] = proxy_string
+        emit({"event": "result", "index": index, "result": result})
+        if 'error' not in result:
+            passed += 1
+            if stop_after and passed >= stop_after:
+                enough.set()
+        return result
+
+    tasks = [asyncio.ensure_future(check_one(i, p)) for i, p in enumerate(proxy_strings)]
+    finished = asyncio.ensure_future(asyncio.gather(*tasks))
+    stopped = asyncio.ensure_future(enough.wait())
+    try:
+        await asyncio.wait([finished, stopped], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks + [stopped]:
+            task.cancel()
+        await asyncio.gather(finished, return_exceptions=True)
+    results = [task.result() for task in tasks if not task.cancelled() and task.result() is not None]
+
+    succeeded = sorted((r for r in results if 'error' not in r), key=lambda r: r['distance_miles'])
+    failed = [r for r in results if 'error' in r]
+    rejected = sum(1 for r in failed if 'rejected' in r)
+    skipped = len(proxy_strings) - len(results)
+    emit({
+        "event": "done", "total": len(results), "succeeded": len(succeeded), "failed": len(failed),
+        "rejected": rejected, "skipped": skipped,
+    })
+
+    return {
+        "target_input": target_address,
+        "target_resolved": target_coords['place_name'],
+        "target_lat": target_coords['lat'],
+        "target_lon": target_coords['lon'],
+        "total": len(results),
+        "succeeded": len(succeeded),
+        "failed": len(failed),
+        "rejected": rejected,
+        "skipped": skipped,
+        "concurrency": limit,
+        "results": succeeded + failed
+    }
+
+
+def run_batch(proxy_strings, target_address, mapbox_key, ip2location_key, concurrency=BATCH_CONCURRENCY, force=False, timings=False,
+              rules=None, stop_after=None):
+    """Synchronous wrapper around run_batch_async()."""
+    return run_sync(run_batch_async(proxy_strings, target_address, mapbox_key, ip2location_key, concurrency, force=force, timings=timings,
+                                    rules=rules, stop_after=stop_after))
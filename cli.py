@@ -0,0 +1,214 @@
+"""Command-line bulk checker.
+
+Reads proxy strings line by line from a file or stdin, checks them against one
+target address with the same pipeline as the web app, and writes one result
+per line (NDJSON or CSV) as soon as each check finishes. Input is streamed
+through a small bounded queue, so memory stays flat for arbitrarily long lists.
+
+    python cli.py --target "1208 Wren St, San Diego, CA 92114" proxies.txt > results.ndjson
+    cat proxies.txt | python cli.py --target "..." --format csv --concurrency 100
+
+With ``--processes N`` the proxies are spread over N processes (see shard.py)
+and results are written in input order.
+"""
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import time
+from itertools import islice
+
+import httpx
+
+# The CLI writes its results itself, so it keeps no check history unless RESULT_DB is set
+os.environ.setdefault('RESULT_DB', '')
+
+from checker import BATCH_CONCURRENCY, geocode_with_mapbox_async, run_check_async, shape_result
+from clients import get_client_pool
+from fastjson import dumps
+from rules import RejectRules
+from shard import check_sharded
+
+CSV_FIELDS = [
+    "line", "proxy_string", "error", "ip", "distance_miles", "distance_km",
+    "city", "region", "country", "isp", "is_proxy", "is_vpn", "is_datacenter",
+    "is_residential", "fraud_score", "cached",
+]
+
+
+class NDJSONWriter:
+    def __init__(self, stream, fields=None, verbose=False):
+        self.stream = stream
+        self.fields = fields
+        self.verbose = verbose
+
+    def write(self, result):
+        shaped = dict(shape_result(result, self.fields, self.verbose), line=result['line'])
+        self.stream.write(dumps(shaped).decode() + '\n')
+        self.stream.flush()
+
+
+class CSVWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, result):
+        self.writer.writerow(result)
+        self.stream.flush()
+
+
+def read_rules(args):
+    rules = RejectRules(args.max_miles, args.clean_only, args.max_fraud_score)
+    return rules if rules.active else None
+
+
+def proxy_lines(source):
+    """Yield (line number, proxy string) for every line that is not blank or a comment."""
+    for line_number, line in enumerate(source, 1):
+        proxy_string = line.strip()
+        if proxy_string and not proxy_string.startswith('#'):
+            yield line_number, proxy_string
+
+
+async def resolve_target(args):
+    try:
+        target_coords = await geocode_with_mapbox_async(args.target, args.mapbox_key)
+    finally:
+        await get_client_pool().aclose()
+    if not target_coords:
+        raise ValueError("Could not geocode the target address. Please check the address and try again.")
+    return target_coords
+
+
+def run_sharded(args, source, writer):
+    target_coords = asyncio.run(resolve_target(args))
+    counts = {"ok": 0, "failed": 0}
+    fields, verbose = (writer.fields, writer.verbose) if isinstance(writer, NDJSONWriter) else (None, False)
+    results = check_sharded(
+        proxy_lines(source), args.target, args.mapbox_key, args.ip2location_key, target_coords,
+        processes=args.processes, concurrency=args.concurrency, force=args.force, rules=read_rules(args),
+        fields=fields, verbose=verbose,
+    )
+    try:
+        for line_number, result in results:
+            counts["failed" if 'error' in result else "ok"] += 1
+            writer.write(dict(result, line=line_number))
+            if args.stop_after and counts["ok"] >= args.stop_after:
+                break
+    finally:
+        results.close()
+    return counts
+
+
+async def run(args, source, writer):
+    target_coords = await geocode_with_mapbox_async(args.target, args.mapbox_key)
+    if not target_coords:
+        raise ValueError("Could not geocode the target address. Please check the address and try again.")
+
+    pending = asyncio.Queue(maxsize=args.concurrency * 2)
+    counts = {"ok": 0, "failed": 0}
+    rules = read_rules(args)
+    enough = asyncio.Event()
+
+    async def read_lines():
+        line_number = 0
+        while True:
+            # Read off the event loop (stdin may block), a few hundred lines at a time
+            lines = await asyncio.to_thread(lambda: list(islice(source, 256)))
+            if not lines:
+                break
+            for line in lines:
+                line_number += 1
+                proxy_string = line.strip()
+                if proxy_string and not proxy_string.startswith('#'):
+                    await pending.put((line_number, proxy_string))
+        for _ in range(args.concurrency):
+            await pending.put(None)
+
+    async def worker():
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            line_number, proxy_string = item
+            result = await run_check_async(
+                proxy_string, args.target, args.mapbox_key, args.ip2location_key, target_coords, force=args.force, rules=rules
+            )
+            if enough.is_set():
+                return
+            counts["failed" if 'error' in result else "ok"] += 1
+            writer.write(dict(result, line=line_number, proxy_string=proxy_string))
+            if args.stop_after and counts["ok"] >= args.stop_after:
+                enough.set()
+
+    # With --stop-after, checks still running once enough proxies passed are cancelled
+    finished = asyncio.ensure_future(asyncio.gather(read_lines(), *(worker() for _ in range(args.concurrency))))
+    stopped = asyncio.ensure_future(enough.wait())
+    try:
+        await asyncio.wait([finished, stopped], return_when=asyncio.FIRST_COMPLETED)
+        if finished.done():
+            finished.result()
+    finally:
+        finished.cancel()
+        stopped.cancel()
+        await asyncio.gather(finished, return_exceptions=True)
+        await get_client_pool().aclose()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check proxy exit locations against a target address.")
+    parser.add_argument('input', nargs='?', default='-', help="file with one proxy string per line (default: stdin)")
+    parser.add_argument('--target', required=True, help="target address to measure distance from")
+    parser.add_argument('--mapbox-key', default=os.environ.get('MAPBOX_KEY', ''), help="Mapbox API key (default: $MAPBOX_KEY)")
+    parser.add_argument('--ip2location-key', default=os.environ.get('IP2LOCATION_KEY', ''), help="IP2Location.io API key (default: $IP2LOCATION_KEY)")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help=f"proxies checked at once, per process (default: {BATCH_CONCURRENCY})")
+    parser.add_argument('--processes', type=int, default=1, help="spread the proxies over this many processes (default: 1; 0 = one per CPU core)")
+    parser.add_argument('--force', action='store_true', help="always probe live, ignoring recently cached results")
+    parser.add_argument('--max-miles', type=float, help="reject exits farther than this from the target")
+    parser.add_argument('--clean-only', action='store_true', help="reject exits with any detection flag set")
+    parser.add_argument('--max-fraud-score', type=float, help="reject exits with a higher fraud score")
+    parser.add_argument('--stop-after', type=int, help="stop once this many proxies pass")
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson', help="output format (default: ndjson)")
+    parser.add_argument('--output', default='-', help="output file (default: stdout)")
+    parser.add_argument('--fields', help="NDJSON: comma-separated result fields to keep")
+    parser.add_argument('--verbose', action='store_true', help="NDJSON: include the debug fields (raw IP intel response)")
+    args = parser.parse_args(argv)
+    args.concurrency = max(1, args.concurrency)
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    if args.format == 'csv':
+        writer = CSVWriter(output)
+    else:
+        fields = [f.strip() for f in args.fields.split(',')] if args.fields else None
+        writer = NDJSONWriter(output, fields, args.verbose)
+
+    started = time.monotonic()
+    try:
+        if args.processes == 1:
+            counts = asyncio.run(run(args, source, writer))
+        else:
+            counts = run_sharded(args, source, writer)
+    except (ValueError, RuntimeError, httpx.HTTPError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    print(
+        f"checked {counts['ok'] + counts['failed']} proxies: {counts['ok']} ok, "
+        f"{counts['failed']} failed in {time.monotonic() - started:.1f}s",
+        file=sys.stderr
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Shared HTTP clients with keep-alive connection pools.
+
+Each upstream API host gets one long-lived httpx.AsyncClient, and each proxy
+gets its own client for the exit-IP probe, so repeated checks reuse open
+connections instead of paying DNS + TCP + TLS (and the proxy CONNECT) every time.
+httpx clients are tied to the event loop that created them, so pools are kept
+per loop.
+"""
+import asyncio
+import os
+import ssl
+import urllib.parse
+import weakref
+from collections import OrderedDict
+
+import certifi
+import httpx
+
+from tracing import CallTimer
+
+# Connections kept per upstream API host (Mapbox, IP2Location.io)
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 100))
+HTTP_MAX_KEEPALIVE = int(os.environ.get('HTTP_MAX_KEEPALIVE', 20))
+# Proxy clients kept open for the exit-IP probe (least recently used are closed first)
+PROXY_CLIENT_CACHE_SIZE = int(os.environ.get('PROXY_CLIENT_CACHE_SIZE', 256))
+# Retries for transient upstream API failures, with exponential backoff starting at HTTP_RETRY_BACKOFF seconds
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.5))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_pools = weakref.WeakKeyDictionary()
+_ssl_context = None
+
+
+def ssl_context():
+    """The TLS context shared by every client.
+
+    httpx builds a fresh context (loading the whole CA bundle, tens of ms of
+    CPU) for each client that isn't given one, and every new proxy gets a client.
+    """
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context(cafile=os.environ.get('SSL_CERT_FILE') or certifi.where())
+    return _ssl_context
+
+
+class ClientPool:
+    """The shared clients of one event loop."""
+
+    def __init__(self):
+        self._upstream = {}
+        self._proxies = OrderedDict()
+
+    def upstream(self, host):
+        """Return the shared client for an upstream API host."""
+        client = self._upstream.get(host)
+        if client is None:
+            client = httpx.AsyncClient(
+                verify=ssl_context(),
+                limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+            )
+            self._upstream[host] = client
+        return client
+
+    def for_proxy(self, proxy_url):
+        """Return the client that routes through ``proxy_url``."""
+        client = self._proxies.get(proxy_url)
+        if client is None:
+            client = httpx.AsyncClient(
+                proxy=proxy_url,
+                verify=ssl_context(),
+                limits=httpx.Limits(max_connections=8, max_keepalive_connections=4)
+            )
+            self._proxies[proxy_url] = client
+            while len(self._proxies) > PROXY_CLIENT_CACHE_SIZE:
+                _, evicted = self._proxies.popitem(last=False)
+                asyncio.get_running_loop().create_task(evicted.aclose())
+        else:
+            self._proxies.move_to_end(proxy_url)
+        return client
+
+    async def aclose(self):
+        clients = list(self._upstream.values()) + list(self._proxies.values())
+        self._upstream.clear()
+        self._proxies.clear()
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+
+
+def get_client_pool():
+    """Return the client pool of the running event loop."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = ClientPool()
+    return pool
+
+
+async def fetch(url, params=None, timeout=10, label='upstream', pace=None):
+    """GET an upstream API URL over its pooled client.
+
+    Connection failures (other than timeouts) and 429/5xx responses are
+    retried up to HTTP_RETRIES times with exponential backoff; a Retry-After
+    header is honoured (up to 30s) when it asks for a longer wait. Each
+    attempt is timed under ``label`` when the check collects timings.
+    ``pace`` (an async callable, e.g. an upstream limiter's acquire) is
+    awaited before every attempt, so retries are paced and counted too.
+    """
+    client = get_client_pool().upstream(urllib.parse.urlsplit(url).hostname)
+    for attempt in range(HTTP_RETRIES + 1):
+        delay = HTTP_RETRY_BACKOFF * 2 ** attempt
+        if pace is not None:
+            await pace()
+        try:
+            with CallTimer(label, url) as timer:
+                response = await client.get(url, params=params, timeout=timeout, extensions=timer.extensions)
+        except httpx.TimeoutException:
+            raise
+        except httpx.TransportError:
+            if attempt == HTTP_RETRIES:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = max(delay, min(int(retry_after), 30))
+        await asyncio.sleep(delay)
@@ -0,0 +1,206 @@
+"""Compare the ip2location-bin backend with the official IP2Location library.
+
+    python compare_ip2location.py /data/IP2LOCATION-LITE-DB11.IPV6.BIN --samples 100000
+    python compare_ip2location.py --dbtypes 1,5,11,26
+
+Given a BIN file, looks up random IPv4 and IPv6 addresses (and IPv4-mapped,
+6to4 and Teredo ones) with both readers. Without one, it writes a small
+synthetic BIN file for each database type (every row's fields are
+distinct, IPv4 and IPv6 tables with their indexes) and also looks up the
+first and last address of sampled ranges.
+Needs ``pip install IP2Location``. Exits non-zero on any mismatch.
+"""
+import argparse
+import ipaddress
+import os
+import random
+import struct
+import sys
+import tempfile
+
+import IP2Location
+from IP2Location import database as official
+
+from ipintel import IP2LocationBinBackend
+
+# Our field -> official record attribute and the position table saying which DB types have it
+FIELDS = {
+    "country_code": ("country_short", official._COUNTRY_POSITION),
+    "country_name": ("country_long", official._COUNTRY_POSITION),
+    "region_name": ("region", official._REGION_POSITION),
+    "city_name": ("city", official._CITY_POSITION),
+    "latitude": ("latitude", official._LATITUDE_POSITION),
+    "longitude": ("longitude", official._LONGITUDE_POSITION),
+    "isp": ("isp", official._ISP_POSITION),
+    "as": ("as_name", official._AS_POSITION),
+    "usage_type": ("usage_type", official._USAGETYPE_POSITION),
+}
+
+POSITIONS = [value for name, value in vars(official).items() if name.endswith('_POSITION')]
+
+HEADER_SIZE = 64
+INDEX_SIZE = 65536 * 8
+
+
+def write_fixture(path, dbtype, ranges=2000, seed=1):
+    """Write a synthetic BIN file of ``dbtype`` with ``ranges`` IPv4 and IPv6 rows."""
+    rng = random.Random(seed)
+    dbcolumn = max(position[dbtype] for position in POSITIONS)
+    floats = {official._LATITUDE_POSITION[dbtype], official._LONGITUDE_POSITION[dbtype]} - {0}
+    country = official._COUNTRY_POSITION[dbtype]
+
+    strings = bytearray()
+
+    def string(text):
+        data = text.encode('latin-1')
+        offset = len(strings)
+        strings.extend(bytes([len(data)]) + data)
+        return offset
+
+    def columns(n):
+        values = []
+        for position in range(2, dbcolumn + 1):
+            if position in floats:
+                values.append(struct.pack('<f', rng.uniform(-90, 90)))
+            elif position == country:
+                offset = string(chr(65 + n % 26) + chr(65 + n // 26 % 26))
+                string(f"Country {n} \xe9")
+                values.append(offset)
+            else:
+                values.append(string(f"field {position} row {n}"))
+        return values
+
+    def row_starts(bits):
+        # Ranges of very different sizes, plus the edges of the address space
+        starts = {0, 2**bits - 1}
+        while len(starts) < ranges:
+            starts.add(rng.getrandbits(rng.choice((bits // 4, bits // 2, bits))))
+        return sorted(starts)
+
+    tables = {}
+    for version, bits in ((4, 32), (6, 128)):
+        starts = row_starts(bits)
+        tables[version] = (starts, [columns(n) for n in range(len(starts))])
+
+    # Layout: header, IPv4 index, IPv6 index, IPv4 rows, IPv6 rows, strings (offsets are 1-based)
+    v4_index = HEADER_SIZE + 1
+    v6_index = v4_index + INDEX_SIZE
+    v4_addr = v6_index + INDEX_SIZE
+    v4_width, v6_width = dbcolumn * 4, dbcolumn * 4 + 12
+    v4_count, v6_count = len(tables[4][0]), len(tables[6][0])
+    # One extra row after each table: the last row's ip_to is read from it
+    v6_addr = v4_addr + (v4_count + 1) * v4_width
+    strings_base = v6_addr - 1 + (v6_count + 1) * v6_width
+
+    out = bytearray(struct.pack('<5B6I', dbtype, dbcolumn, 24, 1, 1, v4_count - 1, v4_addr, v6_count - 1, v6_addr,
+                                v4_index, v6_index))
+    out.extend(bytes([1, 1]))
+    out.extend(bytes(HEADER_SIZE - len(out)))
+
+    for version, ip_size, shift in ((4, 4, 16), (6, 16, 112)):
+        starts = tables[version][0]
+        row = 0
+        for prefix in range(65536):
+            first, last = prefix << shift, ((prefix + 1) << shift) - 1
+            while row + 1 < len(starts) and starts[row + 1] <= first:
+                row += 1
+            high = row
+            while high + 1 < len(starts) and starts[high + 1] <= last:
+                high += 1
+            out.extend(struct.pack('<II', row, high))
+
+    for version, ip_size in ((4, 4), (6, 16)):
+        starts, rows = tables[version]
+        for start, values in zip(starts, rows):
+            out.extend(start.to_bytes(ip_size, 'little'))
+            for value in values:
+                out.extend(value if isinstance(value, bytes) else struct.pack('<I', strings_base + value))
+        out.extend(bytes(dbcolumn * 4 + ip_size - 4))
+
+    assert len(out) == strings_base
+    with open(path, 'wb') as f:
+        f.write(out + strings)
+    return tables
+
+
+def sample_addresses(tables, samples, rng):
+    """Random addresses, range edges from ``tables`` (version -> sorted ip_from list) and embedded IPv4."""
+    addresses = ['0.0.0.0', '255.255.255.255', '::', 'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff']
+    for _ in range(samples):
+        addresses.append(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+        addresses.append(str(ipaddress.IPv6Address(rng.getrandbits(128))))
+    for version, starts in tables.items():
+        address_class = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        for start in rng.sample(starts, min(len(starts), samples)):
+            addresses.extend(str(address_class(ipno)) for ipno in (start, start - 1) if ipno >= 0)
+    for _ in range(samples // 10 + 1):
+        v4 = rng.getrandbits(32)
+        addresses.append(f"::ffff:{v4 >> 16:x}:{v4 & 0xffff:x}")  # IPv4-mapped
+        addresses.append(f"2002:{v4 >> 16:x}:{v4 & 0xffff:x}::1")  # 6to4
+        teredo = ~v4 & 0xffffffff
+        addresses.append(f"2001:0:4136:e378:8000:63bf:{teredo >> 16:x}:{teredo & 0xffff:x}")  # Teredo
+    return addresses
+
+
+def differences(ours, theirs, dbtype):
+    if theirs is None or theirs.country_short in ('-', None):
+        return [] if 'error' in ours or ours.get('country_code') in ('-', None) else ['found only by ip2location-bin']
+    if 'error' in ours:
+        return ['found only by IP2Location']
+    found = []
+    for field, (attribute, positions) in FIELDS.items():
+        if not positions[dbtype]:
+            continue
+        mine, official_value = ours[field], getattr(theirs, attribute)
+        if field in ('latitude', 'longitude'):
+            official_value = float(official_value)
+        if mine != official_value:
+            found.append(f"{field}: {mine!r} != {official_value!r}")
+    return found
+
+
+def compare(path, addresses):
+    """Look ``addresses`` up with both readers; prints the first few mismatches and returns the count."""
+    ours = IP2LocationBinBackend(path)
+    theirs = IP2Location.IP2Location(path)
+    mismatches = 0
+    for address in addresses:
+        found = differences(ours.get(address), theirs.get_all(address), ours._dbtype)
+        if found:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"  {address}: {'; '.join(found)}")
+    theirs.close()
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', help="IP2Location BIN file (default: synthetic files)")
+    parser.add_argument('--samples', type=int, default=2000, help="Random addresses per IP version")
+    parser.add_argument('--dbtypes', default=','.join(str(n) for n in range(1, 27)),
+                        help="Synthetic database types to build (default: 1-26)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    failed = False
+    if args.path:
+        addresses = sample_addresses({}, args.samples, rng)
+        mismatches = compare(args.path, addresses)
+        print(f"{args.path}: {len(addresses)} lookups, {mismatches} mismatches")
+        failed = mismatches > 0
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            for dbtype in (int(n) for n in args.dbtypes.split(',')):
+                path = os.path.join(tmp, f"DB{dbtype}.BIN")
+                tables = write_fixture(path, dbtype, seed=args.seed + dbtype)
+                addresses = sample_addresses({v: starts for v, (starts, _) in tables.items()}, args.samples, rng)
+                mismatches = compare(path, addresses)
+                print(f"DB{dbtype}: {len(addresses)} lookups, {mismatches} mismatches")
+                failed = failed or mismatches > 0
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
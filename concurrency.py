@@ -0,0 +1,134 @@
+"""Adaptive concurrency limits for proxy gateways.
+
+Rotating-residential gateways (one host:port fronting many sessions) start
+throttling or dropping connections when too many sessions open at once, and
+the right number differs per provider and time of day. Each gateway gets an
+AIMD limiter, the scheme TCP uses for its congestion window: every healthy
+probe raises the limit a little (additive increase), and a probe that timed
+out or was refused by the proxy cuts it in half (multiplicative decrease).
+Which exceptions count is up to the caller (see ``GatewayLimits``).
+"""
+import asyncio
+import time
+from collections import deque
+
+
+class AIMDLimiter:
+    """Concurrency limit for one gateway.
+
+    A probe is healthy if it succeeded and the recent latency is within
+    ``tolerance`` times the long-run latency; a probe slower than that holds
+    the limit where it is. Decreases happen at most once per recent latency,
+    so a burst of failures from one overload only halves the limit once.
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=200, backoff=0.5, tolerance=2.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.successes = 0
+        self.overloads = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        """Wait for a free slot."""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller was cancelled
+                self._release_slot()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self, elapsed, overloaded):
+        """Free a slot and adjust the limit for how the probe went."""
+        if overloaded:
+            self.overloads += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= (self.latency or elapsed):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self.successes += 1
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            self.baseline = elapsed if self.baseline is None else 0.98 * self.baseline + 0.02 * elapsed
+            if self.latency <= self.tolerance * self.baseline:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._release_slot()
+
+    def release_unused(self):
+        """Free a slot without judging the gateway (the probe was cancelled)."""
+        self._release_slot()
+
+    def stats(self):
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "baseline_ms": round(self.baseline * 1000, 1) if self.baseline is not None else None,
+            "successes": self.successes,
+            "overloads": self.overloads,
+        }
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class GatewayLimits:
+    """One AIMDLimiter per gateway ``host:port``, created on first use.
+
+    ``overload_errors`` are the exception types that count as the gateway
+    pushing back; any other exception leaves the limit alone.
+    """
+
+    def __init__(self, overload_errors, **limiter_options):
+        self.overload_errors = overload_errors
+        self.limiter_options = limiter_options
+        self._limiters = {}
+
+    def slot(self, gateway):
+        limiter = self._limiters.get(gateway)
+        if limiter is None:
+            limiter = self._limiters[gateway] = AIMDLimiter(**self.limiter_options)
+        return _Slot(limiter, self.overload_errors)
+
+    def stats(self):
+        return {gateway: limiter.stats() for gateway, limiter in sorted(self._limiters.items())}
+
+
+class _Slot:
+    def __init__(self, limiter, overload_errors):
+        self.limiter = limiter
+        self.overload_errors = overload_errors
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self.started = time.monotonic()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None and not issubclass(exc_type, self.overload_errors):
+            self.limiter.release_unused()
+        else:
+            self.limiter.release(time.monotonic() - self.started, overloaded=exc_type is not None)
@@ -0,0 +1,184 @@
+"""Exit-IP discovery: ask IP echo services what address a proxy exits from.
+
+Several echo endpoints are raced through the proxy and the first valid answer
+wins; the losers are cancelled. Each endpoint keeps a moving average of its
+latency, and races start with the fastest endpoint so that, with a hedge delay
+configured, the slower ones are only contacted when the fast one stalls.
+"""
+import asyncio
+import ipaddress
+import os
+import time
+
+import httpx
+
+from metrics import ECHO_SECONDS
+from tracing import CallTimer
+
+# Default echo services as url|json-field pairs; the field may hold "ip1, ip2" (httpbin)
+DEFAULT_ECHO_ENDPOINTS = (
+    "https://api.ipify.org?format=json|ip,"
+    "https://httpbin.org/ip|origin,"
+    "https://ipinfo.io/json|ip"
+)
+# Seconds to wait for the current leader before also asking the next endpoint (0 = ask all at once)
+EXIT_IP_HEDGE_DELAY = float(os.environ.get('EXIT_IP_HEDGE_DELAY', 0))
+EXIT_IP_TIMEOUT = float(os.environ.get('EXIT_IP_TIMEOUT', 30))
+
+
+class ProxyUnreachable(ConnectionError):
+    """No echo service could be reached through the proxy.
+
+    ``kind`` names the failure for outcome metrics: ``timeout`` or
+    ``proxy_error`` (raised as the subclasses below), otherwise
+    ``connection_error``.
+    """
+    kind = 'connection_error'
+
+
+class ProxyTimeout(ProxyUnreachable):
+    """Every echo request through the proxy timed out."""
+    kind = 'timeout'
+
+
+class ProxyRefused(ProxyUnreachable):
+    """The proxy refused the tunnel or the credentials (httpx.ProxyError, e.g. a 407)."""
+    kind = 'proxy_error'
+
+
+def unreachable_error(failures):
+    """The exception to raise for the echo requests' ``failures``."""
+    if any(isinstance(e, httpx.ProxyError) for e in failures):
+        return ProxyRefused("Proxy connection failed - check your proxy credentials")
+    if failures and all(isinstance(e, httpx.TimeoutException) for e in failures):
+        return ProxyTimeout("Connection timeout - proxy may be unreachable")
+    return ProxyUnreachable("Could not connect through proxy")
+
+
+class EchoEndpoint:
+    """An IP echo service and its observed latency through proxies."""
+
+    def __init__(self, url, field):
+        self.url = url
+        self.field = field
+        self.latency = None
+        self.successes = 0
+        self.failures = 0
+
+    def record(self, elapsed, ok):
+        if ok:
+            self.successes += 1
+            self._observe(elapsed)
+        else:
+            self.failures += 1
+
+    def record_lost(self, elapsed):
+        """Record a race this endpoint lost: it would have taken at least ``elapsed``."""
+        if self.latency is None or elapsed > self.latency:
+            self._observe(elapsed)
+
+    def _observe(self, elapsed):
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+
+    def score(self):
+        """Sort key: expected seconds to a valid answer (untried endpoints first)."""
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + self.failures / (self.successes + 1))
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+def parse_endpoints(spec):
+    endpoints = []
+    for item in spec.split(','):
+        url, _, field = item.strip().partition('|')
+        if url:
+            endpoints.append(EchoEndpoint(url, field or 'ip'))
+    return endpoints
+
+
+ECHO_ENDPOINTS = parse_endpoints(os.environ.get('EXIT_IP_ENDPOINTS', DEFAULT_ECHO_ENDPOINTS))
+
+
+def echo_stats():
+    """Per-endpoint latency and success counters, fastest first."""
+    return [endpoint.stats() for endpoint in sorted(ECHO_ENDPOINTS, key=EchoEndpoint.score)]
+
+
+async def _probe(client, endpoint):
+    """Ask one endpoint for the exit IP.
+
+    Returns the IP, or '' if the service answered without a valid IP; raises
+    the request's exception if it could not be reached.
+    """
+    started = time.monotonic()
+    try:
+        with CallTimer('exit_ip', endpoint.url) as timer:
+            response = await client.get(endpoint.url, timeout=EXIT_IP_TIMEOUT, extensions=timer.extensions)
+        value = str(response.json().get(endpoint.field) or '').split(',')[0].strip()
+    except asyncio.CancelledError:
+        elapsed = time.monotonic() - started
+        endpoint.record_lost(elapsed)
+        ECHO_SECONDS.labels(endpoint.url, 'lost').observe(elapsed)
+        raise
+    except Exception:
+        elapsed = time.monotonic() - started
+        endpoint.record(elapsed, ok=False)
+        ECHO_SECONDS.labels(endpoint.url, 'error').observe(elapsed)
+        raise
+    elapsed = time.monotonic() - started
+    try:
+        ipaddress.ip_address(value)
+    except ValueError:
+        endpoint.record(elapsed, ok=False)
+        ECHO_SECONDS.labels(endpoint.url, 'invalid').observe(elapsed)
+        return ''
+    endpoint.record(elapsed, ok=True)
+    ECHO_SECONDS.labels(endpoint.url, 'ok').observe(elapsed)
+    return value
+
+
+async def discover_exit_ip(client):
+    """Race the echo endpoints through ``client`` (a proxied httpx client).
+
+    Returns the first valid IP, or None if the services answered but none
+    gave a usable IP. Raises ProxyUnreachable (a ConnectionError) if no
+    service could be reached.
+    """
+    remaining = sorted(ECHO_ENDPOINTS, key=EchoEndpoint.score)
+    pending = set()
+    answered = False
+    failures = []
+    try:
+        while remaining or pending:
+            if remaining:
+                pending.add(asyncio.ensure_future(_probe(client, remaining.pop(0))))
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=EXIT_IP_HEDGE_DELAY if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            found = None
+            for task in done:
+                if task.exception() is not None:
+                    failures.append(task.exception())
+                    continue
+                ip = task.result()
+                found = found or ip
+                answered = answered or ip == ''
+            if found:
+                return found
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if answered:
+        return None
+    raise unreachable_error(failures)
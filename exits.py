@@ -0,0 +1,193 @@
+"""Index of proxy exits seen by past checks, for nearest-exit queries.
+
+Every successful check adds its exit IP, location and detection flags here.
+Exits are bucketed into a grid of lat/lon cells (like a geohash grid), so a
+radius query only has to measure the exits in the handful of cells the circle
+overlaps. The index lives in memory and is optionally mirrored to SQLite so it
+survives restarts. It holds at most ``max_size`` exits, none older than
+``max_age``; the oldest go first. Writes to SQLite are queued and made in
+batches by a ``BackgroundWriter`` (writer.py), so the event loop never
+waits on disk.
+
+Entries keep the full proxy string, password included, so ``/nearest-exits``
+can hand back a usable proxy. The SQLite file is created readable by its
+owner only; keep it that way.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from ranking import DIRTY_FLAGS, haversine_matrix, is_clean
+from writer import BackgroundWriter
+
+MILES_PER_DEGREE_LAT = 69.0
+
+
+class ExitIndex:
+    """Exits keyed by IP and bucketed by ``cell_degrees`` x ``cell_degrees`` grid cells.
+
+    ``max_size`` caps the number of exits and ``max_age`` (seconds) drops
+    exits not seen for that long; None leaves either unbounded.
+    """
+
+    def __init__(self, path=None, cell_degrees=0.25, max_size=None, max_age=None, batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.cell_degrees = cell_degrees
+        self.max_size = max_size
+        self.max_age = max_age
+        self._columns = round(360 / cell_degrees)
+        self._exits = {}  # oldest first
+        self._cells = {}
+        self._lock = threading.Lock()
+        self._writer = None
+        if path:
+            if not os.path.exists(path):
+                os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+            db = self._connect()
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS exits (ip TEXT PRIMARY KEY, data TEXT NOT NULL, checked_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS exits_checked_at ON exits (checked_at)")
+            db.commit()
+            oldest = time.time() - max_age if max_age else 0
+            rows = db.execute(
+                "SELECT data FROM exits WHERE checked_at >= ? ORDER BY checked_at DESC LIMIT ?",
+                (oldest, max_size if max_size else -1)
+            ).fetchall()
+            db.close()
+            for (data,) in reversed(rows):
+                self._insert(json.loads(data))
+            self._writer = BackgroundWriter(self._connect, self._apply, 'exit-index', batch_size, flush_interval)
+
+    def add(self, proxy_string, result):
+        """Add (or refresh) the exit of a successful check result."""
+        entry = {
+            "ip": result['ip'],
+            "proxy_string": proxy_string,
+            "lat": float(result['actual_lat']),
+            "lon": float(result['actual_lon']),
+            "city": result.get('city'),
+            "region": result.get('region'),
+            "country": result.get('country'),
+            "isp": result.get('isp'),
+            "clean": is_clean(result),
+            "flags": {flag: bool(result.get(flag)) for flag in DIRTY_FLAGS},
+            "checked_at": time.time(),
+        }
+        with self._lock:
+            self._insert(entry)
+            self._evict(entry['checked_at'])
+        if self.path:
+            self._writer.put((entry['ip'], json.dumps(entry), entry['checked_at']))
+
+    def flush(self):
+        """Block until every queued exit is on disk."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def nearest(self, lat, lon, max_miles=10, limit=10, clean_only=True, max_age=None):
+        """Return up to ``limit`` exits within ``max_miles`` of a point, closest first.
+
+        Each entry is the stored exit plus ``distance_miles``. ``max_age``
+        (seconds) skips exits that have not been seen recently. Raises
+        ValueError if ``limit`` is below 1 or ``max_miles`` is negative.
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        if max_miles < 0:
+            raise ValueError("max_miles must not be negative")
+        lat_span = max_miles / MILES_PER_DEGREE_LAT
+        lon_span = max_miles / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        min_row = self._row(max(lat - lat_span, -90))
+        max_row = self._row(min(lat + lat_span, 90))
+        if lon_span >= 180:
+            columns = range(self._columns)
+        else:
+            first = math.floor((lon - lon_span + 180) / self.cell_degrees)
+            last = math.floor((lon + lon_span + 180) / self.cell_degrees)
+            columns = {column % self._columns for column in range(first, last + 1)}
+
+        now = time.time()
+        oldest = now - max_age if max_age else None
+        with self._lock:
+            self._evict(now)
+            candidates = [
+                entry
+                for row in range(min_row, max_row + 1)
+                for column in columns
+                for entry in self._cells.get((row, column), {}).values()
+                if (entry['clean'] or not clean_only) and (oldest is None or entry['checked_at'] >= oldest)
+            ]
+        if not candidates:
+            return []
+
+        distances = haversine_matrix([lat], [lon], [e['lat'] for e in candidates], [e['lon'] for e in candidates])[0]
+        found = sorted(
+            (dict(entry, distance_miles=float(d)) for entry, d in zip(candidates, distances) if d <= max_miles),
+            key=lambda entry: entry['distance_miles']
+        )
+        return found[:limit]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "exits": len(self._exits),
+                "clean_exits": sum(1 for entry in self._exits.values() if entry['clean']),
+                "cells": len(self._cells),
+                "cell_degrees": self.cell_degrees,
+                "max_size": self.max_size,
+                "max_age": self.max_age,
+                "persistent": bool(self.path),
+                "queued": self._writer.queued() if self._writer else 0,
+                "written": self._writer.written if self._writer else 0,
+                "failed": self._writer.failed if self._writer else 0,
+            }
+
+    def _row(self, lat):
+        return math.floor((lat + 90) / self.cell_degrees)
+
+    def _cell(self, entry):
+        return self._row(entry['lat']), math.floor((entry['lon'] + 180) / self.cell_degrees) % self._columns
+
+    def _insert(self, entry):
+        self._remove(entry['ip'])
+        self._exits[entry['ip']] = entry
+        self._cells.setdefault(self._cell(entry), {})[entry['ip']] = entry
+
+    def _remove(self, ip):
+        previous = self._exits.pop(ip, None)
+        if previous is not None:
+            cell = self._cells[self._cell(previous)]
+            cell.pop(ip, None)
+            if not cell:
+                del self._cells[self._cell(previous)]
+
+    def _evict(self, now):
+        # _exits is in insertion order, which is checked_at order, so the oldest exits are first
+        while self.max_size and len(self._exits) > self.max_size:
+            self._remove(next(iter(self._exits)))
+        if self.max_age:
+            oldest = now - self.max_age
+            while self._exits:
+                ip, entry = next(iter(self._exits.items()))
+                if entry['checked_at'] >= oldest:
+                    break
+                self._remove(ip)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def _apply(self, db, rows):
+        db.executemany("INSERT OR REPLACE INTO exits (ip, data, checked_at) VALUES (?, ?, ?)", rows)
+        # Trim the table the same way as the in-memory index
+        if self.max_age:
+            db.execute("DELETE FROM exits WHERE checked_at < ?", (time.time() - self.max_age,))
+        if self.max_size:
+            db.execute(
+                "DELETE FROM exits WHERE checked_at < "
+                "(SELECT checked_at FROM exits ORDER BY checked_at DESC LIMIT 1 OFFSET ?)",
+                (self.max_size - 1,)
+            )
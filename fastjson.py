@@ -0,0 +1,18 @@
+"""JSON encoding for large responses (batch results, event streams).
+
+orjson encodes a few times faster than the standard library and is used
+when installed; otherwise this falls back to ``json`` with compact separators.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj):
+    """Encode ``obj`` as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(',', ':')).encode()
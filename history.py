@@ -0,0 +1,145 @@
+"""History of every check result in SQLite.
+
+Results are queued by ``record()`` and written in batched transactions by a
+``BackgroundWriter`` (writer.py), so the event loop never waits on disk. The database
+runs in WAL mode, which lets the query endpoints read while the writer appends.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from writer import BackgroundWriter
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY,
+        checked_at REAL NOT NULL,
+        host TEXT,
+        port INTEGER,
+        username TEXT,
+        target TEXT,
+        exit_ip TEXT,
+        ok INTEGER NOT NULL,
+        error TEXT,
+        distance_miles REAL,
+        result TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS results_proxy ON results (host, username, checked_at)",
+    "CREATE INDEX IF NOT EXISTS results_exit_ip ON results (exit_ip, checked_at)",
+    "CREATE INDEX IF NOT EXISTS results_checked_at ON results (checked_at)",
+)
+
+COLUMNS = "id, checked_at, host, port, username, target, exit_ip, ok, error, distance_miles, result"
+
+
+class ResultStore:
+    """Append-only check history, written in batches of up to ``batch_size`` rows."""
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0):
+        self.path = path
+        self._read_lock = threading.Lock()
+        self._reader = None
+        self._reader_pid = None
+
+        db = self._connect()
+        db.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.commit()
+        db.close()
+        self._writer = BackgroundWriter(self._connect, _insert_results, 'result-store', batch_size, flush_interval)
+
+    def record(self, proxy_info, target_address, result, checked_at=None):
+        """Queue one check result. ``proxy_info`` is parse_proxy_string() output or None."""
+        proxy_info = proxy_info or {}
+        self._writer.put((
+            checked_at or time.time(),
+            proxy_info.get('host'),
+            proxy_info.get('port'),
+            proxy_info.get('username'),
+            target_address,
+            result.get('ip'),
+            0 if 'error' in result else 1,
+            result.get('error'),
+            result.get('distance_miles'),
+            json.dumps(result),
+        ))
+
+    def flush(self):
+        """Block until every queued result is on disk."""
+        self._writer.flush()
+
+    def recent(self, limit=100, since=None, ok=None):
+        """Most recent results first. ``since`` is a unix time, ``ok`` filters successes/failures."""
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("checked_at >= ?")
+            params.append(since)
+        if ok is not None:
+            clauses.append("ok = ?")
+            params.append(1 if ok else 0)
+        return self._query(clauses, params, limit)
+
+    def history(self, host=None, username=None, exit_ip=None, limit=100):
+        """Results for one proxy (host and/or username) or one exit IP, most recent first."""
+        clauses, params = [], []
+        for column, value in (("host", host), ("username", username), ("exit_ip", exit_ip)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        return self._query(clauses, params, limit)
+
+    def stats(self):
+        with self._read_lock:
+            rows, = self._read_db().execute("SELECT COUNT(*) FROM results").fetchone()
+        return {
+            "path": self.path,
+            "rows": rows,
+            "queued": self._writer.queued(),
+            "written": self._writer.written,
+            "failed": self._writer.failed,
+        }
+
+    def _query(self, clauses, params, limit):
+        sql = f"SELECT {COLUMNS} FROM results"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY checked_at DESC LIMIT ?"
+        with self._read_lock:
+            rows = self._read_db().execute(sql, params + [limit]).fetchall()
+        return [
+            {
+                "id": row[0],
+                "checked_at": row[1],
+                "host": row[2],
+                "port": row[3],
+                "username": row[4],
+                "target": row[5],
+                "exit_ip": row[6],
+                "ok": bool(row[7]),
+                "error": row[8],
+                "distance_miles": row[9],
+                "result": json.loads(row[10]),
+            }
+            for row in rows
+        ]
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def _read_db(self):
+        # SQLite connections must not be shared across a fork, so each process opens its own
+        if self._reader_pid != os.getpid():
+            self._reader = self._connect()
+            self._reader_pid = os.getpid()
+        return self._reader
+
+
+def _insert_results(db, rows):
+    db.executemany(
+        "INSERT INTO results (checked_at, host, port, username, target, exit_ip, ok, error, distance_miles, result) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
@@ -0,0 +1,108 @@
+"""Exit hunting: rotate a SOAX-style proxy's session ID until close exits turn up.
+
+A sticky-session username (``...-sessionid-abc123-sessionlength-600``) keeps
+one exit for the session's lifetime; a new session ID usually means a new
+exit IP. ``hunt_exits`` tries fresh session IDs of one proxy string in
+parallel and stops as soon as ``k`` exits fall within ``max_miles`` of the
+target, or when the attempt budget (or time budget) runs out.
+"""
+import asyncio
+import re
+import secrets
+import time
+
+import httpx
+
+from checker import geocode_with_mapbox_async, run_check_async
+from ranking import is_clean
+
+# Upper bounds for one hunt
+HUNT_MAX_BUDGET = 500
+HUNT_MAX_CONCURRENCY = 50
+
+
+def with_session_id(proxy_string, session_id):
+    """Return ``proxy_string`` with its username's session ID replaced (or added)."""
+    username, separator, rest = proxy_string.partition(':')
+    if re.search(r'sessionid-[^-]*', username, re.IGNORECASE):
+        username = re.sub(r'(sessionid-)[^-]*', lambda m: m.group(1) + session_id, username, count=1, flags=re.IGNORECASE)
+    else:
+        username = f"{username}-sessionid-{session_id}"
+    return username + separator + rest
+
+
+async def hunt_exits(proxy_string, target_address, mapbox_key, ip2location_key, k=1, max_miles=5,
+                     budget=50, concurrency=10, clean_only=True, time_budget=None, on_event=None):
+    """Probe fresh sessions of ``proxy_string`` until ``k`` acceptable exits are found.
+
+    An exit is acceptable within ``max_miles`` of the target and, with
+    ``clean_only``, without detection flags. At most ``budget`` sessions are
+    tried, ``concurrency`` at a time, for at most ``time_budget`` seconds;
+    probes still running when the hunt ends are cancelled. ``on_event``
+    receives ``geocoded``, a ``result`` per finished session (tagged with
+    ``index`` and ``accepted``) and ``done``.
+    """
+    emit = on_event or (lambda event: None)
+    try:
+        target_coords = await geocode_with_mapbox_async(target_address, mapbox_key)
+    except ValueError as e:
+        return {"error": str(e)}
+    except httpx.HTTPError as e:
+        return {"error": f"Error: {str(e)}"}
+    if not target_coords:
+        return {"error": "Could not geocode the target address. Please check the address and try again."}
+    emit({"event": "geocoded", "target": target_coords})
+
+    started = time.monotonic()
+    attempts = iter(range(max(1, min(budget, HUNT_MAX_BUDGET))))
+    results = []
+    found = []
+    enough = asyncio.Event()
+
+    async def worker():
+        for index in attempts:
+            variant = with_session_id(proxy_string, secrets.token_hex(6))
+            result = await run_check_async(variant, target_address, mapbox_key, ip2location_key, target_coords)
+            result["proxy_string"] = variant
+            accepted = 'error' not in result and result['distance_miles'] <= max_miles and (is_clean(result) or not clean_only)
+            results.append(result)
+            if accepted:
+                found.append(result)
+            emit({"event": "result", "index": index, "accepted": accepted, "result": result})
+            if len(found) >= k:
+                enough.set()
+                return
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(1, min(concurrency, HUNT_MAX_CONCURRENCY)))]
+    finished = asyncio.ensure_future(asyncio.gather(*workers))
+    stopped = asyncio.ensure_future(enough.wait())
+    try:
+        await asyncio.wait([finished, stopped], timeout=time_budget, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in workers + [stopped]:
+            task.cancel()
+        await asyncio.gather(finished, return_exceptions=True)
+
+    succeeded = sorted((r for r in results if 'error' not in r), key=lambda r: r['distance_miles'])
+    found.sort(key=lambda r: r['distance_miles'])
+    emit({
+        "event": "done", "total": len(results), "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded), "found": len(found),
+    })
+
+    return {
+        "target_input": target_address,
+        "target_resolved": target_coords['place_name'],
+        "target_lat": target_coords['lat'],
+        "target_lon": target_coords['lon'],
+        "k": k,
+        "max_miles": max_miles,
+        "found": found[:k],
+        "complete": len(found) >= k,
+        "attempts": len(results),
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "elapsed_seconds": round(time.monotonic() - started, 2),
+        # The best sessions seen, in case none was close enough
+        "closest": succeeded[:max(k, 5)],
+    }
@@ -0,0 +1,336 @@
+"""IP intelligence backends: where a proxy's exit IP gets its location and proxy flags.
+
+Every backend returns a dict shaped like an IP2Location.io response
+(``latitude``, ``longitude``, ``city_name``, ``is_proxy``, ``proxy``, ...), so the
+check pipeline does not care which one answered. Lookup failures are reported
+the same way IP2Location.io reports them: ``{"error": {"error_message": ...}}``.
+
+- ``ip2location-api``: the IP2Location.io web service (needs an API key per request).
+- ``ip2location-bin``: a local IP2Location DB1-DB26 BIN file.
+- ``mmdb``: a local MaxMind DB file (GeoLite2/GeoIP2 City, ASN, Anonymous IP, ...).
+
+The local backends memory-map the database, so lookups cost a binary search
+(BIN) or a tree walk (MMDB) over the mapped pages and never touch the network.
+"""
+import ipaddress
+import mmap
+import os
+import struct
+
+from clients import fetch
+
+# Base URL of the IP2Location.io API (override to point at a compatible stand-in)
+IP2LOCATION_API_URL = os.environ.get('IP2LOCATION_API_URL', 'https://api.ip2location.io').rstrip('/')
+
+
+class IP2LocationAPIBackend:
+    """Look IPs up with the IP2Location.io web service."""
+
+    name = 'ip2location-api'
+    remote = True
+
+    async def lookup(self, ip, api_key=None, pace=None):
+        response = await fetch(f"{IP2LOCATION_API_URL}/?key={api_key}&ip={ip}", timeout=10, label='ip_intel', pace=pace)
+        return response.json()
+
+
+# Column positions per database type (DB1-DB26), from the IP2Location BIN specification
+_BIN_COUNTRY_POSITION = (0, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2)
+_BIN_REGION_POSITION = (0, 0, 0, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3)
+_BIN_CITY_POSITION = (0, 0, 0, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4, 4)
+_BIN_ISP_POSITION = (0, 0, 3, 0, 5, 0, 7, 5, 7, 0, 8, 0, 9, 0, 9, 0, 9, 0, 9, 7, 9, 0, 9, 7, 9, 9, 9)
+_BIN_LATITUDE_POSITION = (0, 0, 0, 0, 0, 5, 5, 0, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 5)
+_BIN_LONGITUDE_POSITION = (0, 0, 0, 0, 0, 6, 6, 0, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6, 6)
+_BIN_USAGETYPE_POSITION = (0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 12, 20, 20, 20)
+_BIN_AS_POSITION = (0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 25)
+
+
+def _not_found(ip):
+    return {"error": {"error_message": f"{ip} not found in local IP database"}}
+
+
+class IP2LocationBinBackend:
+    """Look IPs up in a memory-mapped IP2Location BIN database.
+
+    Rows are sorted by ``ip_from``; the 65536-entry index narrows the search to
+    the rows sharing the address's top 16 bits, then a binary search finds the
+    row whose [ip_from, next ip_from) range contains the address.
+    """
+
+    name = 'ip2location-bin'
+    remote = False
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (self._dbtype, self._dbcolumn, _, _, _,
+         self._v4_count, self._v4_addr, self._v6_count, self._v6_addr,
+         self._v4_index, self._v6_index) = struct.unpack_from('<5B6I', self._mm, 0)
+        if not 1 <= self._dbtype < len(_BIN_COUNTRY_POSITION) or self._mm[29] not in (0, 1):
+            raise ValueError(f"{path} is not an IP2Location DB1-DB26 BIN file")
+
+    async def lookup(self, ip, api_key=None):
+        return self.get(ip)
+
+    def get(self, ip):
+        addr = ipaddress.ip_address(ip)
+        # IPv4-mapped, 6to4 and Teredo addresses are looked up by their IPv4 address, as the official reader does
+        if addr.version == 6:
+            addr = addr.ipv4_mapped or addr.sixtofour or (addr.teredo and addr.teredo[1]) or addr
+
+        # BIN offsets are 1-based; rows are an ip_from followed by dbcolumn-1 4-byte columns
+        if addr.version == 4:
+            ipno = min(int(addr), 2**32 - 2)
+            base, count, index, ip_size, index_shift = self._v4_addr - 1, self._v4_count, self._v4_index, 4, 16
+        else:
+            if not self._v6_count:
+                return _not_found(ip)
+            ipno = min(int(addr), 2**128 - 2)
+            base, count, index, ip_size, index_shift = self._v6_addr - 1, self._v6_count, self._v6_index, 16, 112
+        width = self._dbcolumn * 4 + ip_size - 4
+
+        low, high = 0, count
+        if index:
+            low, high = struct.unpack_from('<II', self._mm, index - 1 + ((ipno >> index_shift) << 3))
+
+        while low <= high:
+            mid = (low + high) // 2
+            row = base + mid * width
+            ip_from = int.from_bytes(self._mm[row:row + ip_size], 'little')
+            ip_to = int.from_bytes(self._mm[row + width:row + width + ip_size], 'little')
+            if ip_from <= ipno < ip_to:
+                return self._read_row(ip, row + ip_size - 4)
+            if ipno < ip_from:
+                high = mid - 1
+            else:
+                low = mid + 1
+        return _not_found(ip)
+
+    def _column(self, row, positions):
+        position = positions[self._dbtype]
+        return row + 4 * (position - 1) if position else None
+
+    def _string(self, row, positions, skip=0):
+        column = self._column(row, positions)
+        if column is None:
+            return None
+        offset = struct.unpack_from('<I', self._mm, column)[0] + skip
+        length = self._mm[offset]
+        return self._mm[offset + 1:offset + 1 + length].decode('latin-1')
+
+    def _float(self, row, positions):
+        column = self._column(row, positions)
+        if column is None:
+            return 0
+        return round(struct.unpack_from('<f', self._mm, column)[0], 6)
+
+    def _read_row(self, ip, row):
+        return {
+            "ip": ip,
+            "country_code": self._string(row, _BIN_COUNTRY_POSITION),
+            "country_name": self._string(row, _BIN_COUNTRY_POSITION, skip=3),
+            "region_name": self._string(row, _BIN_REGION_POSITION) or 'Unknown',
+            "city_name": self._string(row, _BIN_CITY_POSITION) or 'Unknown',
+            "latitude": self._float(row, _BIN_LATITUDE_POSITION),
+            "longitude": self._float(row, _BIN_LONGITUDE_POSITION),
+            "isp": self._string(row, _BIN_ISP_POSITION) or 'Unknown',
+            "as": self._string(row, _BIN_AS_POSITION) or 'Unknown',
+            "usage_type": self._string(row, _BIN_USAGETYPE_POSITION),
+            "source": self.name,
+        }
+
+
+_MMDB_METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+
+
+class MMDBBackend:
+    """Look IPs up in a memory-mapped MaxMind DB (MMDB) file.
+
+    Implements the MaxMind DB format: the address bits walk a binary search
+    tree until they reach a pointer into the data section, which is decoded
+    on demand.
+    """
+
+    name = 'mmdb'
+    remote = False
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        marker = self._mm.rfind(_MMDB_METADATA_MARKER, max(0, len(self._mm) - 128 * 1024))
+        if marker == -1:
+            raise ValueError(f"{path} is not a MaxMind DB file")
+        metadata_start = marker + len(_MMDB_METADATA_MARKER)
+        self.metadata = self._decode(metadata_start, metadata_start)[0]
+
+        self._node_count = self.metadata['node_count']
+        self._record_size = self.metadata['record_size']
+        if self._record_size not in (24, 28, 32):
+            raise ValueError(f"Unsupported MMDB record size {self._record_size}")
+        self._ip_version = self.metadata['ip_version']
+        self._tree_size = self._record_size * 2 // 8 * self._node_count
+        self._data_start = self._tree_size + 16
+
+        # IPv4 addresses live under ::/96 in IPv6 trees
+        self._ipv4_start = 0
+        if self._ip_version == 6:
+            for _ in range(96):
+                if self._ipv4_start >= self._node_count:
+                    break
+                self._ipv4_start = self._read_node(self._ipv4_start, 0)
+
+    async def lookup(self, ip, api_key=None):
+        return self.get(ip)
+
+    def get(self, ip):
+        record = self.get_record(ip)
+        if record is None:
+            return _not_found(ip)
+        return self._to_ip2location(ip, record)
+
+    def get_record(self, ip):
+        """Return the raw MMDB record for an IP, or None."""
+        addr = ipaddress.ip_address(ip)
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        if addr.version == 6 and self._ip_version == 4:
+            return None
+
+        bit_count = addr.max_prefixlen
+        node = self._ipv4_start if addr.version == 4 else 0
+        ipno = int(addr)
+        for i in range(bit_count):
+            if node >= self._node_count:
+                break
+            node = self._read_node(node, (ipno >> (bit_count - 1 - i)) & 1)
+
+        if node <= self._node_count:
+            return None
+        return self._decode(self._tree_size + node - self._node_count, self._data_start)[0]
+
+    def _read_node(self, node, bit):
+        mm = self._mm
+        if self._record_size == 24:
+            offset = node * 6 + bit * 3
+            return int.from_bytes(mm[offset:offset + 3], 'big')
+        if self._record_size == 28:
+            offset = node * 7
+            if bit == 0:
+                return ((mm[offset + 3] & 0xF0) << 20) | int.from_bytes(mm[offset:offset + 3], 'big')
+            return ((mm[offset + 3] & 0x0F) << 24) | int.from_bytes(mm[offset + 4:offset + 7], 'big')
+        offset = node * 8 + bit * 4
+        return int.from_bytes(mm[offset:offset + 4], 'big')
+
+    def _decode(self, offset, base):
+        """Decode the data field at ``offset``; pointers are relative to ``base``.
+
+        Returns (value, offset just past the field).
+        """
+        mm = self._mm
+        ctrl = mm[offset]
+        offset += 1
+        kind = ctrl >> 5
+
+        if kind == 1:
+            size = (ctrl >> 3) & 0x3
+            value = ctrl & 0x7
+            if size == 0:
+                pointer = (value << 8) | mm[offset]
+            elif size == 1:
+                pointer = ((value << 16) | int.from_bytes(mm[offset:offset + 2], 'big')) + 2048
+            elif size == 2:
+                pointer = ((value << 24) | int.from_bytes(mm[offset:offset + 3], 'big')) + 526336
+            else:
+                pointer = int.from_bytes(mm[offset:offset + 4], 'big')
+            return self._decode(base + pointer, base)[0], offset + size + 1
+
+        if kind == 0:
+            kind = 7 + mm[offset]
+            offset += 1
+
+        size = ctrl & 0x1f
+        if size >= 29:
+            extra = size - 28
+            size = (29, 285, 65821)[extra - 1] + int.from_bytes(mm[offset:offset + extra], 'big')
+            offset += extra
+
+        if kind == 2:
+            return mm[offset:offset + size].decode('utf-8'), offset + size
+        if kind == 3:
+            return struct.unpack_from('>d', mm, offset)[0], offset + 8
+        if kind == 4:
+            return bytes(mm[offset:offset + size]), offset + size
+        if kind in (5, 6, 9, 10):
+            return int.from_bytes(mm[offset:offset + size], 'big'), offset + size
+        if kind == 7:
+            result = {}
+            for _ in range(size):
+                key, offset = self._decode(offset, base)
+                result[key], offset = self._decode(offset, base)
+            return result, offset
+        if kind == 8:
+            return int.from_bytes(mm[offset:offset + size], 'big', signed=size == 4), offset + size
+        if kind == 11:
+            result = []
+            for _ in range(size):
+                item, offset = self._decode(offset, base)
+                result.append(item)
+            return result, offset
+        if kind == 14:
+            return bool(size), offset
+        if kind == 15:
+            return struct.unpack_from('>f', mm, offset)[0], offset + 4
+        raise ValueError(f"Unsupported MMDB data type {kind}")
+
+    def _to_ip2location(self, ip, record):
+        def name(section):
+            return (section or {}).get('names', {}).get('en')
+
+        country = record.get('country') or record.get('registered_country') or {}
+        subdivisions = record.get('subdivisions') or [{}]
+        location = record.get('location', {})
+        traits = record.get('traits', {})
+
+        # Anonymous IP databases keep the flags at the top level, GeoIP2 Insights under traits
+        flags = dict(traits, **record)
+        result = {
+            "ip": ip,
+            "country_code": country.get('iso_code'),
+            "country_name": name(country) or 'Unknown',
+            "region_name": name(subdivisions[0]) or 'Unknown',
+            "city_name": name(record.get('city')) or 'Unknown',
+            "latitude": location.get('latitude', 0),
+            "longitude": location.get('longitude', 0),
+            "isp": traits.get('isp') or flags.get('autonomous_system_organization') or 'Unknown',
+            "as": flags.get('autonomous_system_organization') or 'Unknown',
+            "source": self.name,
+        }
+        if any(key.startswith('is_') for key in flags):
+            result["is_proxy"] = bool(flags.get('is_anonymous') or flags.get('is_anonymous_proxy'))
+            result["proxy"] = {
+                "is_vpn": flags.get('is_anonymous_vpn', False),
+                "is_tor": flags.get('is_tor_exit_node', False),
+                "is_data_center": flags.get('is_hosting_provider', False),
+                "is_public_proxy": flags.get('is_public_proxy', False),
+                "is_residential_proxy": flags.get('is_residential_proxy', False),
+            }
+        return result
+
+
+BACKENDS = {
+    IP2LocationAPIBackend.name: IP2LocationAPIBackend,
+    IP2LocationBinBackend.name: IP2LocationBinBackend,
+    MMDBBackend.name: MMDBBackend,
+}
+
+
+def load_backend(name, path=None):
+    """Create the backend called ``name``; local backends need a database ``path``."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown IP intel backend {name!r} - expected one of {', '.join(BACKENDS)}")
+    backend = BACKENDS[name]
+    if not backend.remote:
+        if not path:
+            raise ValueError(f"IP intel backend {name!r} needs a database file (IP_INTEL_DB)")
+        return backend(path)
+    return backend()
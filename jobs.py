@@ -0,0 +1,399 @@
+"""Background sweep jobs that outlive the HTTP request that started them.
+
+``POST /jobs`` stores a sweep (proxy list, target, options) in SQLite and
+returns straight away; a scheduler on the engine loop claims queued jobs and
+checks their proxies in the background, saving results as they come in. The
+status and result endpoints read the database, so any gunicorn worker can
+answer for any job.
+
+A running job's owner refreshes its heartbeat every JOB_POLL_INTERVAL
+seconds. If the owner dies (worker restart, crash), the heartbeat goes stale
+and another process — or the restarted one — claims the job again and
+checks only the proxies that have no saved result yet. Results from the last
+second before a crash may be checked twice. API keys are kept with the job
+until it finishes, then erased.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from checker import (
+    BATCH_CONCURRENCY,
+    BATCH_MAX_CONCURRENCY,
+    geocode_with_mapbox_async,
+    get_engine_loop,
+    run_check_async,
+    shape_result,
+)
+from fastjson import dumps
+from rules import RejectRules
+
+logger = logging.getLogger('proxy_checker')
+
+# SQLite file holding jobs and their results; set JOB_DB= (empty) to disable jobs
+JOB_DB = os.environ.get('JOB_DB', 'jobs.db')
+JOB_MAX_PROXIES = int(os.environ.get('JOB_MAX_PROXIES', 100000))
+# Jobs one process runs at a time; more wait in the queue
+JOB_MAX_RUNNING = int(os.environ.get('JOB_MAX_RUNNING', 2))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+# A running job whose heartbeat is older than this is taken over by another process
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 30))
+JOB_RETENTION_DAYS = float(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+FINISHED_STATES = ('done', 'cancelled', 'failed')
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        heartbeat REAL,
+        owner TEXT,
+        target TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        params TEXT NOT NULL,
+        mapbox_key TEXT,
+        ip2location_key TEXT,
+        error TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)",
+    """CREATE TABLE IF NOT EXISTS job_results (
+        job_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        ok INTEGER NOT NULL,
+        rejected INTEGER NOT NULL,
+        distance_miles REAL,
+        result TEXT NOT NULL,
+        PRIMARY KEY (job_id, idx)
+    )""",
+)
+
+STATUS_COLUMNS = "id, state, created_at, started_at, finished_at, target, total, error"
+
+
+class JobManager:
+    """Stores sweep jobs in SQLite and runs them on the engine loop, at most ``max_running`` per process."""
+
+    def __init__(self, path, max_running=JOB_MAX_RUNNING, poll_interval=JOB_POLL_INTERVAL, stale_after=JOB_STALE_SECONDS):
+        self.path = path
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._started_pid = None
+        self._owner = None
+        self._running = {}
+        self._wake = None
+
+    def resume(self):
+        """Start the scheduler if the database already exists, to pick up jobs left queued or running.
+
+        Without a database there is nothing to resume; ``submit`` starts the
+        scheduler (and creates the file) when the first job arrives. Cheap
+        once the scheduler runs, so it can be called on every request.
+        """
+        if self._started_pid != os.getpid() and os.path.exists(self.path):
+            self.start()
+
+    def start(self):
+        """Start this process's scheduler (once per process; a no-op after the first call)."""
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            # Set up before _started_pid is published: a concurrent submit() returns early and sets _wake.
+            # asyncio.Event binds to the loop on first use (Python 3.10+), so it can be created here.
+            self._wake = asyncio.Event()
+            self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._running = {}
+            self._started_pid = os.getpid()
+        asyncio.run_coroutine_threadsafe(self._schedule(), get_engine_loop())
+
+    def submit(self, proxy_strings, target_address, mapbox_key, ip2location_key, options):
+        """Queue a sweep and return its job ID. ``options``: concurrency, force, stop_after and rule fields."""
+        job_id = uuid.uuid4().hex
+        params = dict(options, proxy_strings=proxy_strings)
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute(
+                    "INSERT INTO jobs (id, state, created_at, target, total, params, mapbox_key, ip2location_key) "
+                    "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                    (job_id, time.time(), target_address, len(proxy_strings), dumps(params).decode(), mapbox_key, ip2location_key)
+                )
+        self.start()
+        get_engine_loop().call_soon_threadsafe(self._wake.set)
+        return job_id
+
+    def status(self, job_id):
+        """The job's state and progress counts, or None for an unknown job."""
+        with self._lock:
+            db = self._connection()
+            row = db.execute(f"SELECT {STATUS_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(ok), 0), COALESCE(SUM(rejected), 0) FROM job_results WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        return _status(row, counts)
+
+    def recent(self, limit=100):
+        """Most recent jobs first, without per-job result counts."""
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT {STATUS_COLUMNS} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [_status(row) for row in rows]
+
+    def results(self, job_id, offset=0, limit=100, sort='index', ok=None):
+        """Saved results of a job: in input order, or ``sort='distance'`` (passed checks closest first, then failures)."""
+        clauses, params = ["job_id = ?"], [job_id]
+        if ok is not None:
+            clauses.append("ok = ?")
+            params.append(1 if ok else 0)
+        order = "ok DESC, distance_miles, idx" if sort == 'distance' else "idx"
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT idx, result FROM job_results WHERE {' AND '.join(clauses)} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [dict(json.loads(result), index=index) for index, result in rows]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns False if it is unknown or already finished."""
+        with self._lock:
+            db = self._connection()
+            with db:
+                cursor = db.execute(
+                    "UPDATE jobs SET state = 'cancelled', finished_at = ?, mapbox_key = NULL, ip2location_key = NULL "
+                    "WHERE id = ? AND state IN ('queued', 'running')",
+                    (time.time(), job_id)
+                )
+        if not cursor.rowcount:
+            return False
+        # The owner notices at its next heartbeat; stop it right away if it is this process
+        task = self._running.get(job_id)
+        if task is not None:
+            get_engine_loop().call_soon_threadsafe(task.cancel)
+        return True
+
+    def _connection(self):
+        # One connection per process (SQLite connections must not cross a fork), used under self._lock
+        if self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db_pid = os.getpid()
+            self._db.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+        return self._db
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            db = self._connection()
+            with db:
+                return db.execute(sql, params)
+
+    async def _schedule(self):
+        last_cleanup = 0
+        while True:
+            self._wake.clear()
+            try:
+                if time.time() - last_cleanup > 3600:
+                    last_cleanup = time.time()
+                    await asyncio.to_thread(self._delete_expired)
+                while len(self._running) < self.max_running:
+                    job_id = await asyncio.to_thread(self._claim)
+                    if job_id is None:
+                        break
+                    task = asyncio.ensure_future(self._run(job_id))
+                    self._running[job_id] = task
+                    task.add_done_callback(lambda _, job_id=job_id: self._running.pop(job_id, None))
+            except sqlite3.Error:
+                logger.exception("job scheduler")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _claim(self):
+        """Take the oldest queued job, or another process's running one whose heartbeat went stale."""
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE state = 'queued' OR (state = 'running' AND heartbeat < ? AND owner != ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now - self.stale_after, self._owner)
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET state = 'running', owner = ?, heartbeat = ?, started_at = COALESCE(started_at, ?) WHERE id = ?",
+                        (self._owner, now, now, row[0])
+                    )
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+        return row[0] if row is not None else None
+
+    def _load(self, job_id):
+        with self._lock:
+            db = self._connection()
+            target, params, mapbox_key, ip2location_key = db.execute(
+                "SELECT target, params, mapbox_key, ip2location_key FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            done = db.execute("SELECT idx, ok FROM job_results WHERE job_id = ?", (job_id,)).fetchall()
+        return target, json.loads(params), mapbox_key or '', ip2location_key or '', done
+
+    def _save(self, job_id, rows):
+        """Write finished results and refresh the heartbeat; returns False if the job was cancelled or taken over."""
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO job_results (job_id, idx, ok, rejected, distance_miles, result) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                cursor = db.execute(
+                    "UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ? AND state = 'running'",
+                    (time.time(), job_id, self._owner)
+                )
+        return cursor.rowcount == 1
+
+    def _finish(self, job_id, state, error=None):
+        self._execute(
+            "UPDATE jobs SET state = ?, finished_at = ?, error = ?, mapbox_key = NULL, ip2location_key = NULL "
+            "WHERE id = ? AND owner = ? AND state = 'running'",
+            (state, time.time(), error, job_id, self._owner)
+        )
+
+    def _delete_expired(self):
+        cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute(
+                    "DELETE FROM job_results WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (cutoff,)
+                )
+                db.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+
+    async def _run(self, job_id):
+        target_address, params, mapbox_key, ip2location_key, done = await asyncio.to_thread(self._load, job_id)
+        proxy_strings = params['proxy_strings']
+        checked = {index for index, _ in done}
+        passed = sum(ok for _, ok in done)
+        stop_after = params.get('stop_after')
+        rules = RejectRules.from_request(params)
+        logger.info("job %s: %s of %d proxies left", job_id, len(proxy_strings) - len(checked), len(proxy_strings))
+
+        try:
+            target_coords = await geocode_with_mapbox_async(target_address, mapbox_key)
+        except Exception as e:
+            await asyncio.to_thread(self._finish, job_id, 'failed', f"Error: {str(e)}")
+            return
+        if not target_coords:
+            await asyncio.to_thread(
+                self._finish, job_id, 'failed', "Could not geocode the target address. Please check the address and try again."
+            )
+            return
+
+        remaining = iter([i for i in range(len(proxy_strings)) if i not in checked])
+        unsaved = []
+        enough = asyncio.Event()
+
+        async def worker():
+            nonlocal passed
+            for index in remaining:
+                proxy_string = proxy_strings[index]
+                result = await run_check_async(
+                    proxy_string, target_address, mapbox_key, ip2location_key, target_coords,
+                    force=params.get('force', False), rules=rules
+                )
+                if enough.is_set():
+                    # Finished alongside the last pass needed: left unsaved, so it counts as skipped
+                    return
+                result["proxy_string"] = proxy_string
+                ok = 'error' not in result
+                unsaved.append((
+                    job_id, index, int(ok), int('rejected' in result), result.get('distance_miles'),
+                    dumps(shape_result(result)).decode(),
+                ))
+                if ok:
+                    passed += 1
+                    if stop_after and passed >= stop_after:
+                        enough.set()
+                        return
+
+        concurrency = max(1, min(params.get('concurrency', BATCH_CONCURRENCY), BATCH_MAX_CONCURRENCY))
+        workers = asyncio.ensure_future(asyncio.gather(*(worker() for _ in range(concurrency))))
+        stopped = asyncio.ensure_future(enough.wait())
+        state = 'done'
+        try:
+            while not (workers.done() or stopped.done()):
+                await asyncio.wait([workers, stopped], timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                rows, unsaved[:] = list(unsaved), []
+                if not await asyncio.to_thread(self._save, job_id, rows):
+                    logger.info("job %s: cancelled or taken over, stopping", job_id)
+                    state = None
+                    break
+            if workers.done() and not workers.cancelled():
+                workers.result()
+        except asyncio.CancelledError:
+            state = None
+            raise
+        except Exception as e:
+            logger.exception("job %s failed", job_id)
+            state = 'failed'
+            await asyncio.to_thread(self._finish, job_id, state, f"Error: {str(e)}")
+            state = None
+        finally:
+            workers.cancel()
+            stopped.cancel()
+            await asyncio.gather(workers, return_exceptions=True)
+            # Results that finished while stopping are kept; they are just as valid
+            rows, unsaved[:] = list(unsaved), []
+            await asyncio.shield(asyncio.to_thread(self._save, job_id, rows))
+            if state is not None:
+                await asyncio.to_thread(self._finish, job_id, state)
+                logger.info("job %s: %s", job_id, state)
+
+
+def _status(row, counts=None):
+    job_id, state, created_at, started_at, finished_at, target, total, error = row
+    status = {
+        "job_id": job_id,
+        "state": state,
+        "target_address": target,
+        "total": total,
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "error": error,
+    }
+    if counts is not None:
+        checked, succeeded, rejected = counts
+        status.update(
+            checked=checked,
+            succeeded=succeeded,
+            failed=checked - succeeded,
+            rejected=rejected,
+            progress=round(checked / total, 4) if total else 1.0,
+        )
+        if state in FINISHED_STATES:
+            status["skipped"] = total - checked
+    return status
+
+
+job_manager = JobManager(JOB_DB) if JOB_DB else None
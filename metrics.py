@@ -0,0 +1,88 @@
+"""Prometheus metrics for the check pipeline, served by /metrics.
+
+Latency histograms and outcome counters are updated as checks run; cache
+and gateway figures are read from their owners' stats() at scrape time.
+Values are per process: with several gunicorn workers each scrape sees the
+worker that answered it.
+"""
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Seconds; wide enough for 30-60s proxy round trips
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    'proxy_checker_stage_seconds', "Duration of one check stage (geocode, exit_ip, ip_intel)",
+    ['stage'], buckets=LATENCY_BUCKETS,
+)
+CHECK_SECONDS = Histogram(
+    'proxy_checker_check_seconds', "Duration of a live check, end to end",
+    buckets=LATENCY_BUCKETS,
+)
+ECHO_SECONDS = Histogram(
+    'proxy_checker_echo_seconds', "Duration of one exit-IP echo request through a proxy",
+    ['endpoint', 'outcome'], buckets=LATENCY_BUCKETS,
+)
+CHECK_OUTCOMES = Counter(
+    'proxy_checker_checks', "Finished checks by outcome",
+    ['outcome'],
+)
+CHECKS_IN_FLIGHT = Gauge('proxy_checker_checks_in_flight', "Live checks currently running")
+
+
+class StatsCollector:
+    """Exports cache hit/miss counts, coalesced lookups and gateway concurrency limits at scrape time."""
+
+    def __init__(self, caches, gateway_limits, flights):
+        self.caches = caches
+        self.gateway_limits = gateway_limits
+        self.flights = flights
+
+    def collect(self):
+        hits = CounterMetricFamily('proxy_checker_cache_hits', "Cache hits", labels=['cache'])
+        misses = CounterMetricFamily('proxy_checker_cache_misses', "Cache misses", labels=['cache'])
+        ratio = GaugeMetricFamily('proxy_checker_cache_hit_ratio', "Cache hits / lookups", labels=['cache'])
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            ratio.add_metric([name], stats['hit_ratio'])
+        yield hits
+        yield misses
+        yield ratio
+
+        calls = CounterMetricFamily('proxy_checker_lookup_calls', "Upstream lookups started after a cache miss", labels=['lookup'])
+        coalesced = CounterMetricFamily(
+            'proxy_checker_lookup_coalesced', "Cache misses that joined an identical lookup already in flight", labels=['lookup']
+        )
+        for name, flight in self.flights.items():
+            stats = flight.stats()
+            calls.add_metric([name], stats['calls'])
+            coalesced.add_metric([name], stats['coalesced'])
+        yield calls
+        yield coalesced
+
+        limit = GaugeMetricFamily('proxy_checker_gateway_limit', "Adaptive concurrency limit per gateway", labels=['gateway'])
+        in_flight = GaugeMetricFamily('proxy_checker_gateway_in_flight', "Probes in flight per gateway", labels=['gateway'])
+        queued = GaugeMetricFamily('proxy_checker_gateway_queued', "Probes waiting for a slot per gateway", labels=['gateway'])
+        latency = GaugeMetricFamily('proxy_checker_gateway_latency_seconds', "Recent probe latency per gateway", labels=['gateway'])
+        for gateway, stats in self.gateway_limits.stats().items():
+            limit.add_metric([gateway], stats['limit'])
+            in_flight.add_metric([gateway], stats['in_flight'])
+            queued.add_metric([gateway], stats['queued'])
+            if stats['latency_ms'] is not None:
+                latency.add_metric([gateway], stats['latency_ms'] / 1000)
+        yield limit
+        yield in_flight
+        yield queued
+        yield latency
+
+
+def register_stats(caches, gateway_limits, flights):
+    """Export ``caches`` (name -> TTLCache), ``gateway_limits`` and ``flights`` (name -> SingleFlight) on /metrics."""
+    REGISTRY.register(StatsCollector(caches, gateway_limits, flights))
+
+
+def render():
+    """Return the exposition body and its content type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,81 @@
+"""Vectorized distance ranking of proxy exits against target addresses.
+
+``haversine_matrix`` is the NumPy counterpart of checker.haversine_distance
+for whole arrays of points; ``nearest_exits`` uses it to pick the k closest
+clean exits for each of many targets in one call.
+"""
+import numpy as np
+
+EARTH_RADIUS_MILES = 3959
+
+# Result flags that disqualify an exit from being "clean"
+DIRTY_FLAGS = (
+    "is_proxy", "is_vpn", "is_tor", "is_datacenter", "is_public_proxy",
+    "is_residential", "is_web_proxy", "is_web_crawler",
+)
+
+# Targets handled per block, so the distance matrix stays small for huge inputs
+TARGET_BLOCK_SIZE = 1024
+
+
+def haversine_matrix(lats1, lons1, lats2, lons2):
+    """Distances in miles between every point of set 1 (rows) and set 2 (columns)."""
+    lat1 = np.radians(np.asarray(lats1, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(lons1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lats2, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(lons2, dtype=float))[None, :]
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_MILES * c
+
+
+def is_clean(exit_info):
+    """True if none of the detection flags are set on a check result."""
+    return not any(exit_info.get(flag) for flag in DIRTY_FLAGS)
+
+
+def nearest_exits(exits, targets, k=5, max_miles=None, clean_only=True):
+    """Return the ``k`` closest exits for each target, closest first.
+
+    ``exits`` are check results (``actual_lat``/``actual_lon`` plus the
+    detection flags); ``targets`` are dicts with ``lat``/``lon`` (e.g. geocode
+    results). Returns one list per target of ``(exit, distance_miles)`` pairs,
+    limited to ``max_miles`` when given. Raises ValueError for ``k`` below 1 or
+    a negative ``max_miles``.
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    if max_miles is not None and max_miles < 0:
+        raise ValueError("max_miles must not be negative")
+    if clean_only:
+        exits = [e for e in exits if is_clean(e)]
+    if not exits or not targets:
+        return [[] for _ in targets]
+
+    exit_lats = np.array([e['actual_lat'] for e in exits], dtype=float)
+    exit_lons = np.array([e['actual_lon'] for e in exits], dtype=float)
+    k = min(k, len(exits))
+
+    ranked = []
+    for start in range(0, len(targets), TARGET_BLOCK_SIZE):
+        block = targets[start:start + TARGET_BLOCK_SIZE]
+        distances = haversine_matrix([t['lat'] for t in block], [t['lon'] for t in block], exit_lats, exit_lons)
+
+        # argpartition finds the k smallest per row in linear time; only those k get sorted
+        if k < len(exits):
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.broadcast_to(np.arange(len(exits)), (len(block), len(exits)))
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+
+        for indexes, row in zip(nearest, nearest_distances):
+            ranked.append([
+                (exits[i], float(d)) for i, d in zip(indexes, row)
+                if max_miles is None or d <= max_miles
+            ])
+    return ranked
@@ -0,0 +1,193 @@
+"""Pacing and monthly quota accounting for the upstream APIs (Mapbox, IP2Location.io).
+
+Each API key gets a token bucket per upstream: calls over the rate wait their
+turn instead of being sent and bounced with a 429. Calls are also counted
+against a monthly budget per key; the counts are kept in SQLite so they
+survive restarts and are shared by every worker process using the same file.
+"""
+import asyncio
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class QuotaExceeded(ValueError):
+    """The monthly budget for an upstream API key is used up."""
+
+
+def key_fingerprint(api_key):
+    """Stable short ID for an API key, so keys themselves are never stored or shown."""
+    return hashlib.sha256((api_key or '').encode()).hexdigest()[:16]
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per second on average, with bursts of up to ``burst`` calls."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.waiting = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        # Taking the token up front (the balance may go negative) queues callers in arrival order
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= tokens
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    async def acquire(self):
+        """Wait until a call may be made."""
+        wait = self._reserve(1)
+        if not wait:
+            return
+        self.waiting += 1
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self._reserve(-1)
+            raise
+        finally:
+            self.waiting -= 1
+
+
+class UpstreamLimiter:
+    """Token buckets and monthly call counts per (upstream, API key).
+
+    ``limits`` maps an upstream name to ``(rate_per_second, monthly_quota)``;
+    0 disables either limit. Counts are written to ``path`` every
+    ``flush_interval`` seconds and at exit. ``acquire`` only does the
+    in-memory bookkeeping on the event loop; reading and writing ``path``
+    happens in a worker thread.
+    """
+
+    def __init__(self, limits, path=None, flush_interval=5.0):
+        self.limits = limits
+        self.path = path
+        self.flush_interval = flush_interval
+        self._buckets = {}
+        self._usage = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._flushed = time.monotonic()
+        self._flushing = None
+        if path:
+            db = sqlite3.connect(path, timeout=30)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS quota_usage (upstream TEXT NOT NULL, key_id TEXT NOT NULL, "
+                "period TEXT NOT NULL, used INTEGER NOT NULL, PRIMARY KEY (upstream, key_id, period))"
+            )
+            db.commit()
+            db.close()
+            atexit.register(self.flush)
+
+    async def acquire(self, upstream, api_key):
+        """Count one call against the key's budget, then wait for its rate limit.
+
+        Raises QuotaExceeded once the month's budget is spent.
+        """
+        rate, monthly_quota = self.limits.get(upstream, (0, 0))
+        key = (upstream, key_fingerprint(api_key), time.strftime('%Y-%m', time.gmtime()))
+        if key not in self._usage and self.path:
+            used = await asyncio.to_thread(self._read_used, key)
+            with self._lock:
+                self._usage.setdefault(key, used)
+        with self._lock:
+            self._usage.setdefault(key, 0)
+            if monthly_quota and self._usage[key] >= monthly_quota:
+                raise QuotaExceeded(f"Monthly {upstream} quota of {monthly_quota} requests used up for this API key")
+            self._usage[key] += 1
+            self._pending[key] = self._pending.get(key, 0) + 1
+            bucket = self._buckets.get(key[:2])
+            if bucket is None and rate:
+                bucket = self._buckets[key[:2]] = TokenBucket(rate, max(1.0, rate))
+        if self.path and self._flushing is None and time.monotonic() - self._flushed >= self.flush_interval:
+            self._flushing = asyncio.ensure_future(self._flush_in_background())
+        if bucket is not None:
+            await bucket.acquire()
+
+    async def _flush_in_background(self):
+        try:
+            await asyncio.to_thread(self.flush)
+        finally:
+            self._flushing = None
+
+    def flush(self):
+        """Write pending counts, and pick up counts added by other processes. Blocks on SQLite."""
+        if not self.path:
+            return
+        with self._lock:
+            self._flushed = time.monotonic()
+            pending, self._pending = self._pending, {}
+            keys = list(self._usage)
+        with self._db_lock:
+            db = self._connection()
+            with db:
+                db.executemany(
+                    "INSERT INTO quota_usage (upstream, key_id, period, used) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (upstream, key_id, period) DO UPDATE SET used = used + excluded.used",
+                    [key + (count,) for key, count in pending.items()]
+                )
+            stored = {key: self._select_used(db, key) for key in keys}
+        with self._lock:
+            # Calls counted while the database was busy are not in ``stored`` yet
+            for key, used in stored.items():
+                self._usage[key] = used + self._pending.get(key, 0)
+
+    def stats(self):
+        """Budget and pacing per upstream and API key for the current month. Blocks on SQLite."""
+        period = time.strftime('%Y-%m', time.gmtime())
+        stored = {}
+        if self.path:
+            with self._db_lock:
+                stored = {
+                    (upstream, key_id, period): used
+                    for upstream, key_id, used in self._connection().execute(
+                        "SELECT upstream, key_id, used FROM quota_usage WHERE period = ?", (period,)
+                    )
+                }
+        report = {upstream: [] for upstream in self.limits}
+        with self._lock:
+            for key in sorted(k for k in set(self._usage) | set(stored) if k[2] == period and k[0] in self.limits):
+                upstream, key_id, _ = key
+                rate, monthly_quota = self.limits[upstream]
+                used = self._usage[key] if key in self._usage else stored[key]
+                bucket = self._buckets.get((upstream, key_id))
+                report[upstream].append({
+                    "key_id": key_id,
+                    "period": period,
+                    "used": used,
+                    "monthly_quota": monthly_quota or None,
+                    "remaining": max(0, monthly_quota - used) if monthly_quota else None,
+                    "rate_per_second": rate or None,
+                    "queued": bucket.waiting if bucket is not None else 0,
+                })
+        return report
+
+    def _connection(self):
+        # One connection per process (SQLite connections must not cross a fork), used under self._db_lock
+        if self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _read_used(self, key):
+        with self._db_lock:
+            return self._select_used(self._connection(), key)
+
+    @staticmethod
+    def _select_used(db, key):
+        row = db.execute(
+            "SELECT used FROM quota_usage WHERE upstream = ? AND key_id = ? AND period = ?", key
+        ).fetchone()
+        return row[0] if row else 0
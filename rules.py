@@ -0,0 +1,80 @@
+"""Rejection rules that end a check as soon as its outcome is decided.
+
+Each rule looks at one piece of a check and is evaluated the moment that
+piece exists: excluded exit IPs right after the exit-IP probe (before the IP
+intel lookup spends quota), detection flags and fraud score as soon as the IP
+intel arrives (without waiting for the target geocode), and the distance once
+both ends are known. A check that breaks a rule stops there and returns an
+error result tagged with ``rejected`` (the rule's name).
+"""
+from ranking import DIRTY_FLAGS
+
+
+class Rejected(Exception):
+    """Raised inside a check when a rule rejects the exit; carries what is known so far."""
+
+    def __init__(self, rule, message, details):
+        super().__init__(message)
+        self.rule = rule
+        self.message = message
+        self.details = details
+
+    def as_result(self):
+        return dict(self.details, error=f"Rejected: {self.message}", rejected=self.rule)
+
+
+class RejectRules:
+    """Limits an exit must meet. Unset limits are not checked."""
+
+    def __init__(self, max_miles=None, clean_only=False, max_fraud_score=None, exclude_ips=()):
+        self.max_miles = max_miles
+        self.clean_only = clean_only
+        self.max_fraud_score = max_fraud_score
+        self.exclude_ips = frozenset(exclude_ips)
+
+    @classmethod
+    def from_request(cls, data):
+        """Read ``max_miles``, ``clean_only``, ``max_fraud_score`` and ``exclude_ips``; None if none are set."""
+        try:
+            max_miles = float(data['max_miles']) if data.get('max_miles') is not None else None
+            max_fraud_score = float(data['max_fraud_score']) if data.get('max_fraud_score') is not None else None
+        except (TypeError, ValueError):
+            raise ValueError("max_miles and max_fraud_score must be numbers")
+        exclude_ips = data.get('exclude_ips') or ()
+        if isinstance(exclude_ips, str):
+            exclude_ips = [ip.strip() for ip in exclude_ips.split(',') if ip.strip()]
+        if not isinstance(exclude_ips, (list, tuple)):
+            raise ValueError("exclude_ips must be a list or a comma-separated string")
+        rules = cls(max_miles, bool(data.get('clean_only', False)), max_fraud_score, exclude_ips)
+        return rules if rules.active else None
+
+    @property
+    def active(self):
+        return self.max_miles is not None or self.clean_only or self.max_fraud_score is not None or bool(self.exclude_ips)
+
+    def check_exit_ip(self, ip):
+        if ip in self.exclude_ips:
+            raise Rejected('exclude_ips', f"exit IP {ip} is excluded", {"ip": ip})
+
+    def check_exit(self, details):
+        """Check the detection flags and fraud score of an exit (check-result field names)."""
+        if self.clean_only:
+            flags = [flag for flag in DIRTY_FLAGS if details.get(flag)]
+            if flags:
+                raise Rejected('clean_only', f"exit is flagged ({', '.join(flags)})", details)
+        fraud_score = details.get('fraud_score')
+        if self.max_fraud_score is not None and isinstance(fraud_score, (int, float)) and fraud_score > self.max_fraud_score:
+            raise Rejected('max_fraud_score', f"fraud score {fraud_score} is over {self.max_fraud_score:g}", details)
+
+    def check_distance(self, distance_miles, details):
+        if self.max_miles is not None and distance_miles > self.max_miles:
+            raise Rejected(
+                'max_miles', f"exit is {distance_miles:.1f} miles from the target (max {self.max_miles:g})",
+                dict(details, distance_miles=distance_miles)
+            )
+
+    def check_result(self, result):
+        """Apply every rule to a finished check result (e.g. a reused one)."""
+        self.check_exit_ip(result['ip'])
+        self.check_exit(result)
+        self.check_distance(result['distance_miles'], result)
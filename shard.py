@@ -0,0 +1,196 @@
+"""Spread a sweep over several processes, one event loop each.
+
+Parsing, IP intel JSON decoding and result shaping are CPU work that one
+process does behind the GIL. ``check_sharded`` starts ``processes`` shard
+processes, each checking proxies on its own event loop, and feeds them
+proxies from a shared queue in small chunks, so a shard that is slow (bad
+proxies, timeouts) simply takes fewer. Results come back as one stream in
+input order. At most ``SHARD_WINDOW_PER_SLOT`` proxies per check slot are
+handed out ahead of the oldest unreturned result, so one stuck proxy cannot
+make finished results pile up without limit while they wait for it.
+
+Every shard has its own caches, HTTP clients and limiters. Upstream rate
+limits and the per-gateway concurrency limits are divided between the
+shards so the sweep as a whole stays within them. Monthly quota counts are
+shared through QUOTA_DB as usual.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+
+from checker import (
+    BATCH_CONCURRENCY,
+    exit_index,
+    gateway_limits,
+    geocode_cache,
+    ip_intel_cache,
+    result_cache,
+    result_store,
+    run_check_async,
+    shape_result,
+    upstream_limiter,
+)
+from clients import get_client_pool
+
+# Proxies handed to a shard at a time
+SHARD_CHUNK_SIZE = 32
+# Proxies fed but not yet yielded, per check slot (processes x concurrency)
+SHARD_WINDOW_PER_SLOT = 4
+
+
+def default_processes():
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+def check_sharded(items, target_address, mapbox_key, ip2location_key, target_coords, processes=None,
+                  concurrency=BATCH_CONCURRENCY, force=False, rules=None, fields=None, verbose=False, ordered=True):
+    """Check ``(key, proxy_string)`` pairs across shard processes; yields ``(key, result)``.
+
+    ``items`` may be any iterable (it is read lazily, so a huge file never sits
+    in memory). ``target_coords`` is the geocoded target, resolved once by the
+    caller. Each shard checks up to ``concurrency`` proxies at once. Results
+    are shaped with ``fields``/``verbose`` inside the shards and carry
+    ``proxy_string``. They are yielded in input order, or as they finish with
+    ``ordered=False``. Closing the generator early stops the shards.
+    """
+    processes = max(1, processes or default_processes())
+    window = threading.Semaphore(max(SHARD_CHUNK_SIZE, processes * concurrency * SHARD_WINDOW_PER_SLOT))
+    closed = threading.Event()
+    context = multiprocessing.get_context('spawn')
+    inbox = context.Queue(maxsize=processes * 4)
+    outbox = context.Queue()
+    shards = [
+        context.Process(
+            target=_shard_main, name=f'check-shard-{n}', daemon=True,
+            args=(inbox, outbox, processes, target_address, mapbox_key, ip2location_key, target_coords,
+                  concurrency, force, rules, fields, verbose),
+        )
+        for n in range(processes)
+    ]
+    for shard in shards:
+        shard.start()
+
+    feed_error = []
+
+    def feed():
+        try:
+            chunk = []
+            for seq, (key, proxy_string) in enumerate(items):
+                if not window.acquire(blocking=False):
+                    # Send what we have first: the oldest unreturned result may be in it
+                    if chunk:
+                        inbox.put(chunk)
+                        chunk = []
+                    window.acquire()
+                if closed.is_set():
+                    return
+                chunk.append((seq, key, proxy_string))
+                if len(chunk) == SHARD_CHUNK_SIZE:
+                    inbox.put(chunk)
+                    chunk = []
+            if chunk:
+                inbox.put(chunk)
+        except Exception as e:
+            feed_error.append(e)
+        finally:
+            for _ in shards:
+                inbox.put(None)
+
+    feeder = threading.Thread(target=feed, name='shard-feeder', daemon=True)
+    feeder.start()
+
+    finished = 0
+    waiting = {}
+    next_seq = 0
+    try:
+        while finished < len(shards):
+            try:
+                message = outbox.get(timeout=1)
+            except queue.Empty:
+                crashed = [shard for shard in shards if shard.exitcode not in (None, 0)]
+                if crashed:
+                    raise RuntimeError(f"{crashed[0].name} exited with code {crashed[0].exitcode}")
+                continue
+            if message is None:
+                finished += 1
+                continue
+            seq, key, result = message
+            if not ordered:
+                window.release()
+                yield key, result
+                continue
+            waiting[seq] = (key, result)
+            while next_seq in waiting:
+                window.release()
+                yield waiting.pop(next_seq)
+                next_seq += 1
+        if feed_error:
+            raise feed_error[0]
+    finally:
+        # Unblock the feeder if it is waiting for room in the window
+        closed.set()
+        window.release()
+        for shard in shards:
+            if shard.is_alive():
+                shard.terminate()
+        for shard in shards:
+            shard.join()
+        inbox.cancel_join_thread()
+        outbox.cancel_join_thread()
+
+
+def _shard_main(inbox, outbox, processes, target_address, mapbox_key, ip2location_key, target_coords,
+                concurrency, force, rules, fields, verbose):
+    # Each shard gets its share of the upstream rates and gateway concurrency
+    upstream_limiter.limits = {
+        upstream: (rate / processes, monthly_quota) for upstream, (rate, monthly_quota) in upstream_limiter.limits.items()
+    }
+    options = gateway_limits.limiter_options
+    min_limit = options.get('min_limit', 1)
+    for name in ('initial', 'max_limit'):
+        if name in options:
+            options[name] = max(min_limit, options[name] // processes)
+
+    asyncio.run(_shard_async(inbox, outbox, target_address, mapbox_key, ip2location_key, target_coords,
+                             concurrency, force, rules, fields, verbose))
+    upstream_limiter.flush()
+    exit_index.flush()
+    for cache in (geocode_cache, ip_intel_cache, result_cache):
+        cache.flush()
+    if result_store is not None:
+        result_store.flush()
+    outbox.put(None)
+
+
+async def _shard_async(inbox, outbox, target_address, mapbox_key, ip2location_key, target_coords,
+                       concurrency, force, rules, fields, verbose):
+    pending = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def read_chunks():
+        while True:
+            chunk = await asyncio.to_thread(inbox.get)
+            if chunk is None:
+                break
+            for item in chunk:
+                await pending.put(item)
+        for _ in range(concurrency):
+            await pending.put(None)
+
+    async def worker():
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            seq, key, proxy_string = item
+            result = await run_check_async(
+                proxy_string, target_address, mapbox_key, ip2location_key, target_coords, force=force, rules=rules
+            )
+            result["proxy_string"] = proxy_string
+            outbox.put((seq, key, shape_result(result, fields, verbose)))
+
+    try:
+        await asyncio.gather(read_chunks(), *(worker() for _ in range(concurrency)))
+    finally:
+        await get_client_pool().aclose()
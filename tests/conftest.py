@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Keep the app's SQLite stores in memory (or off) and its logs quiet while testing
+os.environ.update({
+    "RESULT_DB": "",
+    "QUOTA_DB": "",
+    "JOB_DB": "",
+    "LOG_LEVEL": "WARNING",
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
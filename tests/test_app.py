@@ -0,0 +1,32 @@
+import pytest
+
+from app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_best_proxies_rejects_k_below_one(client, k):
+    response = client.post('/best-proxies', json={"exits": [], "target_addresses": ["San Diego"], "k": k})
+    assert response.status_code == 400
+    assert response.json == {"error": "k must be at least 1"}
+
+
+def test_best_proxies_rejects_negative_max_miles(client):
+    response = client.post('/best-proxies', json={"target_addresses": ["San Diego"], "max_miles": -1})
+    assert response.status_code == 400
+    assert response.json == {"error": "max_miles must not be negative"}
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"limit": 0}, "limit must be at least 1"),
+    ({"limit": -1}, "limit must be at least 1"),
+    ({"max_miles": -5}, "max_miles must not be negative"),
+])
+def test_nearest_exits_rejects_bad_limit_and_radius(client, body, error):
+    response = client.post('/nearest-exits', json=dict(body, target_address="San Diego"))
+    assert response.status_code == 400
+    assert response.json == {"error": error}
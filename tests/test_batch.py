@@ -0,0 +1,19 @@
+import asyncio
+
+import checker
+
+
+def test_stop_after_reports_exactly_k_passes(monkeypatch):
+    async def geocode(address, api_key):
+        return {"lat": 32.7, "lon": -117.1, "place_name": address}
+
+    async def check(proxy_string, *args, **kwargs):
+        # Every check in a wave of ``concurrency`` finishes at the same moment
+        await asyncio.sleep(0.01)
+        return {"ip": proxy_string, "distance_miles": 1.0}
+
+    monkeypatch.setattr(checker, 'geocode_with_mapbox_async', geocode)
+    monkeypatch.setattr(checker, 'run_check_async', check)
+    batch = checker.run_batch([f"u{i}:p@h:1" for i in range(20)], "San Diego", "m", "i", concurrency=5, stop_after=3)
+    assert (batch["succeeded"], batch["failed"], batch["skipped"]) == (3, 0, 17)
+    assert len(batch["results"]) == 3
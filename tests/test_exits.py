@@ -0,0 +1,17 @@
+import pytest
+
+from exits import ExitIndex
+
+RESULT = {"ip": "1.2.3.4", "actual_lat": 32.7, "actual_lon": -117.1}
+
+
+def test_nearest_finds_exit_in_radius():
+    index = ExitIndex()
+    index.add("u:p@h:1", RESULT)
+    assert [exit["ip"] for exit in index.nearest(32.7, -117.1, max_miles=5)] == ["1.2.3.4"]
+
+
+@pytest.mark.parametrize("max_miles, limit", [(10, 0), (10, -1), (-1, 10)])
+def test_nearest_rejects_bad_limit_and_radius(max_miles, limit):
+    with pytest.raises(ValueError):
+        ExitIndex().nearest(32.7, -117.1, max_miles=max_miles, limit=limit)
@@ -0,0 +1,17 @@
+import pytest
+
+from ranking import nearest_exits
+
+EXITS = [{"actual_lat": 32.7, "actual_lon": -117.1}, {"actual_lat": 34.0, "actual_lon": -118.2}]
+TARGET = {"lat": 32.7, "lon": -117.1}
+
+
+def test_nearest_exits_closest_first():
+    [ranked] = nearest_exits(EXITS, [TARGET], k=1)
+    assert [exit for exit, _ in ranked] == [EXITS[0]]
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_nearest_exits_rejects_k_below_one(k):
+    with pytest.raises(ValueError):
+        nearest_exits(EXITS, [TARGET], k=k)
@@ -0,0 +1,38 @@
+import sqlite3
+
+from cache import TTLCache
+from writer import BackgroundWriter
+
+
+def test_background_writer_applies_batches(tmp_path):
+    path = str(tmp_path / "w.db")
+    sqlite3.connect(path).execute("CREATE TABLE t (n INTEGER)").connection.close()
+
+    def insert(db, batch):
+        db.executemany("INSERT INTO t (n) VALUES (?)", [(n,) for n in batch])
+
+    writer = BackgroundWriter(lambda: sqlite3.connect(path, check_same_thread=False), insert, 'test-writer', batch_size=3, flush_interval=0.05)
+    for n in range(10):
+        writer.put(n)
+    writer.flush()
+    assert writer.written == 10 and writer.queued() == 0
+    assert sqlite3.connect(path).execute("SELECT SUM(n) FROM t").fetchone() == (45,)
+
+
+def test_background_writer_counts_failed_batches(tmp_path):
+    def fail(db, batch):
+        db.execute("INSERT INTO missing VALUES (1)")
+
+    writer = BackgroundWriter(lambda: sqlite3.connect(str(tmp_path / "w.db"), check_same_thread=False), fail, 'test-writer', flush_interval=0.05)
+    writer.put(1)
+    writer.put(2)
+    writer.flush()
+    assert (writer.written, writer.failed) == (0, 2)
+
+
+def test_persistent_cache_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = TTLCache(path=path, flush_interval=0.05)
+    cache.set("a", {"x": 1})
+    cache.flush()
+    assert TTLCache(path=path).get("a") == {"x": 1}
@@ -0,0 +1,121 @@
+"""Per-check trace IDs and upstream call timings.
+
+Every check runs under a trace ID that log records pick up through
+TraceIdFilter, so all log lines of one check can be grepped together. When a
+check asks for timings, each HTTP call made on its behalf (Mapbox, IP intel,
+echo services through the proxy) is timed phase by phase from httpcore's
+trace hooks. httpcore resolves names inside its TCP connect, so ``connect_ms``
+includes DNS; a pooled connection that was reused has no connect or TLS time.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+import urllib.parse
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger('proxy_checker')
+
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+# (check start time, list of call timings) while a check collects timings
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+@contextmanager
+def trace(collect_timings=False):
+    """Run a check under a new trace ID. Yields ``(trace_id, calls)``; ``calls`` is None unless collecting."""
+    trace_id = uuid.uuid4().hex[:16]
+    calls = [] if collect_timings else None
+    id_token = _trace_id.set(trace_id)
+    timings_token = _timings.set((time.monotonic(), calls) if collect_timings else None)
+    try:
+        yield trace_id, calls
+    finally:
+        _timings.reset(timings_token)
+        _trace_id.reset(id_token)
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds ``trace_id`` to every record ('-' outside a check)."""
+
+    def filter(self, record):
+        record.trace_id = _trace_id.get() or '-'
+        return True
+
+
+def configure_logging(level='INFO'):
+    """Log to stderr with the trace ID on every line."""
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceIdFilter())
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s'))
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(level)
+    # httpx logs every request URL at INFO, and IP2Location.io keys travel in the query string
+    for name in ('httpx', 'httpcore'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def _between(marks, start, end, occurrence=-1):
+    """Milliseconds between two trace events (the last occurrence of each, by default)."""
+    started = marks.get(start)
+    finished = marks.get(end)
+    if not started or not finished:
+        return None
+    return round((finished[occurrence] - started[occurrence]) * 1000, 1)
+
+
+class CallTimer:
+    """Times one HTTP call for the current check's timings, if it collects them.
+
+        with CallTimer("mapbox", url) as timer:
+            response = await client.get(url, extensions=timer.extensions)
+    """
+
+    def __init__(self, label, url):
+        self.label = label
+        self.host = urllib.parse.urlsplit(str(url)).hostname
+        self.extensions = {}
+        self._marks = {}
+        state = _timings.get()
+        self._check_started, self._calls = state if state is not None else (None, None)
+        if self._calls is not None:
+            self.extensions = {"trace": self._on_event}
+
+    async def _on_event(self, name, info):
+        # Drop the layer prefix ("connection.", "http11.", "http_proxy.") so phases line up
+        self._marks.setdefault(name.split('.', 1)[1], []).append(time.monotonic())
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total_ms = round((time.monotonic() - self._started) * 1000, 1)
+        if exc_type is None:
+            outcome = 'ok'
+        elif issubclass(exc_type, asyncio.CancelledError):
+            outcome = 'cancelled'
+        else:
+            outcome = exc_type.__name__
+        logger.debug("%s %s %s in %.1f ms", self.label, self.host, outcome, total_ms)
+        if self._calls is None:
+            return
+        marks = self._marks
+        self._calls.append({
+            "call": self.label,
+            "host": self.host,
+            "start_ms": round((self._started - self._check_started) * 1000, 1),
+            "connect_ms": _between(marks, 'connect_tcp.started', 'connect_tcp.complete'),
+            # Through an HTTP proxy a CONNECT request goes first, then the real request inside the tunnel
+            "tunnel_ms": _between(marks, 'send_request_headers.started', 'receive_response_headers.complete', 0)
+            if len(marks.get('send_request_headers.started', [])) > 1 else None,
+            "tls_ms": _between(marks, 'start_tls.started', 'start_tls.complete'),
+            "first_byte_ms": _between(marks, 'send_request_headers.started', 'receive_response_headers.complete'),
+            "total_ms": total_ms,
+            "outcome": outcome,
+        })
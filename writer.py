@@ -0,0 +1,80 @@
+"""Background SQLite writer shared by the result store, the caches and the exit index.
+
+Callers ``put()`` items on a queue and return at once; a daemon thread takes
+them off in batches and applies each batch in one transaction, so the event
+loop never waits on disk.
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class BackgroundWriter:
+    """Applies queued items to SQLite in batches of up to ``batch_size``, at least every ``flush_interval`` seconds.
+
+    ``connect()`` opens the writer thread's connection and
+    ``apply_batch(db, batch)`` writes a list of items; it runs inside a
+    transaction, so a batch is written whole or not at all. Items of a
+    failed batch are counted in ``failed`` and dropped.
+    """
+
+    def __init__(self, connect, apply_batch, name, batch_size=200, flush_interval=1.0):
+        self.connect = connect
+        self.apply_batch = apply_batch
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.failed = 0
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def put(self, item):
+        """Queue ``item`` for the next batch."""
+        self._writer_queue().put(item)
+
+    def flush(self):
+        """Block until every queued item is on disk."""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def queued(self):
+        return self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+
+    def _writer_queue(self):
+        # The writer thread does not survive a fork (gunicorn --preload), so each process starts its own
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._write_loop, args=(self._queue,), name=self.name, daemon=True).start()
+        return self._queue
+
+    def _write_loop(self, items):
+        db = self.connect()
+        while True:
+            batch = [items.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(items.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                with db:
+                    self.apply_batch(db, batch)
+                self.written += len(batch)
+            except sqlite3.Error:
+                self.failed += len(batch)
+            finally:
+                for _ in batch:
+                    items.task_done()